@@ -0,0 +1,240 @@
+"""Module for the ArtifactCache class."""
+
+import hashlib as _hashlib
+import json as _json
+import logging as _logging
+import os as _os
+import shutil as _shutil
+import subprocess as _subprocess
+
+from .build_state import hash_command as _hash_command
+from .build_state import hash_file as _hash_file
+from .path_prefix_map import PathPrefixMap as _PathPrefixMap
+
+_LOGGER = _logging.getLogger(__name__)
+
+_ARTIFACT_CACHE_VERSION = 2
+
+# File in a directory of sources restored from the cache, which holds the
+# key of the artifact and the url, version and commit of the sources
+_MARKER = ".clang_build_artifact"
+
+
+def restored_sources(download_directory):
+    """Return the key, url, version and commit of the sources restored to a directory, or None."""
+    try:
+        return dict(_json.loads((download_directory / _MARKER).read_text()))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+class ArtifactCache:
+    """The sources and outputs of external targets, shared by all build directories.
+
+    Targets with a ``url`` are cloned and compiled in every new build
+    directory. Instead, the sources (without the git repository) and the
+    build directory of such a target, i.e. its object files and library
+    or executable, are stored in the cache after a successful build.
+
+    Artifacts are keyed by the commit of the sources, the configuration of
+    the target, the build type and the identity of the toolchain. Before
+    cloning, a branch or tag is resolved to its commit with
+    ``git ls-remote``, so that a new build directory or worktree finds the
+    artifact without cloning anything. Commit hashes are not resolved, and
+    neither are versions whose sources were already restored to the build
+    directory. The key under which a target is stored is always taken from
+    the commit which was actually checked out and built.
+
+    The outputs of a target also depend on the headers and flags of its
+    dependencies. They are stored under a separate build key, which also
+    covers the keys of the dependencies. Dependencies of the project itself
+    are keyed by the content of their files, with paths relative to the
+    project root, so that every clone of the project finds the outputs.
+    """
+
+    def __init__(self, directory, path_prefix_map=None):
+        """Use the cache in ``directory``, with paths mapped by ``path_prefix_map`` in keys of dependencies."""
+        self.directory = directory
+        self.path_prefix_map = path_prefix_map or _PathPrefixMap()
+
+    def key(self, commit, url, config, build_type, toolchain_identity):
+        """Return the key of the artifact of an external target."""
+        return _hashlib.blake2b(
+            _json.dumps(
+                [
+                    _ARTIFACT_CACHE_VERSION,
+                    url,
+                    commit,
+                    config,
+                    build_type.name,
+                    toolchain_identity,
+                ],
+                sort_keys=True,
+                default=str,
+            ).encode(),
+            digest_size=20,
+        ).hexdigest()
+
+    def dependency_key(self, configuration, files):
+        """Return the key of a target of the project, which an external target depends on.
+
+        Parameters
+        ----------
+        configuration : list of str
+            Everything the target is configured from, e.g. its flags and the
+            keys of its own dependencies
+        files : list of pathlib.Path
+            The sources and headers of the target, whose content is hashed
+
+        """
+        key_hash = _hashlib.blake2b(digest_size=20)
+        key_hash.update(_hash_command(configuration, self.path_prefix_map))
+        for path in files:
+            key_hash.update(_hash_command([path], self.path_prefix_map))
+            try:
+                key_hash.update(_hash_file(path))
+            except OSError:
+                pass
+        return key_hash.hexdigest()
+
+    def build_key(self, key, dependency_keys):
+        """Return the key of the outputs of an external target, built with the given dependencies."""
+        return _hashlib.blake2b(
+            _json.dumps([key, sorted(dependency_keys)]).encode(), digest_size=20
+        ).hexdigest()
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def _build_path(self, key, build_key):
+        return self._path(key) / "builds" / build_key
+
+    def contains(self, key):
+        """Return whether the artifact is in the cache."""
+        return (self._path(key) / "sources").is_dir()
+
+    def restore_sources(self, key, download_directory, url, version, commit):
+        """Copy the sources of an artifact to the download directory of a target.
+
+        Sources are only copied into an empty directory, or one with sources
+        restored from the cache before. A clone is not overwritten.
+
+        Parameters
+        ----------
+        key : str
+            The key of the artifact
+        download_directory : pathlib.Path
+            The directory of the external sources of the target
+        url : str
+            The url of the repository of the sources
+        version : str
+            The branch, tag or commit of the target, or None
+        commit : str
+            The commit of the sources
+
+        Returns
+        -------
+        bool
+            Whether the download directory holds the sources of the artifact
+
+        """
+        marker = download_directory / _MARKER
+        sources = {"key": key, "url": url, "version": version, "commit": commit}
+        current = restored_sources(download_directory)
+        if current is not None:
+            if current == sources:
+                return True
+            if current.get("url") == url and current.get("commit") == commit:
+                # The same sources, restored for another configuration
+                marker.write_text(_json.dumps(sources))
+                return True
+            # Sources of another commit, which was restored before
+            _shutil.rmtree(download_directory)
+        if not self.contains(key):
+            return False
+        if download_directory.exists() and any(download_directory.iterdir()):
+            return False
+
+        _LOGGER.info(f'Restoring external sources to "{download_directory}"')
+        try:
+            _shutil.copytree(
+                self._path(key) / "sources", download_directory, dirs_exist_ok=True
+            )
+            marker.write_text(_json.dumps(sources))
+        except OSError as error:
+            _LOGGER.warning(f"Could not restore external sources: {error}")
+            _shutil.rmtree(download_directory, ignore_errors=True)
+            return False
+        return True
+
+    def restore_build(self, key, build_key, build_directory):
+        """Copy the object files and outputs of an artifact to the build directory of a target.
+
+        Returns
+        -------
+        bool
+            Whether the outputs were restored
+
+        """
+        path = self._build_path(key, build_key)
+        if not path.is_dir():
+            return False
+        try:
+            _shutil.copytree(path, build_directory, dirs_exist_ok=True)
+        except OSError as error:
+            _LOGGER.warning(
+                f"Could not restore the outputs of an external target: {error}"
+            )
+            return False
+        _os.utime(self._path(key))
+        return True
+
+    def store(self, key, build_key, download_directory, build_directory=None):
+        """Store the sources and the build directory of a freshly built external target.
+
+        Sources with changes which were not committed are not stored.
+        """
+        build_path = self._build_path(key, build_key)
+        if self.contains(key) and (build_directory is None or build_path.is_dir()):
+            return
+        if (download_directory / ".git").exists():
+            try:
+                changes = _subprocess.run(
+                    ["git", "status", "--porcelain"],
+                    cwd=download_directory,
+                    stdout=_subprocess.PIPE,
+                    stderr=_subprocess.PIPE,
+                    encoding="utf-8",
+                    check=True,
+                ).stdout
+            except (OSError, _subprocess.SubprocessError):
+                return
+            if changes.strip():
+                _LOGGER.debug(
+                    f'Not caching "{download_directory}", which has local changes'
+                )
+                return
+
+        copies = [
+            (
+                download_directory,
+                self._path(key) / "sources",
+                _shutil.ignore_patterns(".git", _MARKER),
+            )
+        ]
+        if build_directory is not None and build_directory.is_dir():
+            copies.append((build_directory, build_path, None))
+        for source, destination, ignore in copies:
+            if destination.is_dir():
+                continue
+            temporary_path = destination.with_name(
+                f"{destination.name}.{_os.getpid()}.tmp"
+            )
+            try:
+                _shutil.copytree(source, temporary_path, ignore=ignore)
+                _os.replace(temporary_path, destination)
+            except OSError as error:
+                _LOGGER.debug(f'Could not cache "{source}": {error}')
+                _shutil.rmtree(temporary_path, ignore_errors=True)
+                return
+        _LOGGER.info(f'Cached the external target in "{download_directory}"')
@@ -0,0 +1,47 @@
+"""Module for the BuildLog class."""
+
+import json as _json
+import logging as _logging
+
+_LOGGER = _logging.getLogger(__name__)
+
+_BUILD_LOG_VERSION = 1
+
+
+class BuildLog:
+    """Statistics about the jobs of previous builds, kept in the build directory.
+
+    Entries are identified by the output file of a job (e.g. an object file or
+    a linked executable) and hold values such as the wall time the job took.
+    The scheduler uses them to estimate how long jobs will take.
+    """
+
+    def __init__(self, path):
+        """Load the build log from ``path``, if it exists.
+
+        An unreadable or outdated log is discarded.
+        """
+        self._path = path
+        self._entries = {}
+        if self._path.exists():
+            try:
+                content = _json.loads(self._path.read_text())
+                if content.get("version") == _BUILD_LOG_VERSION:
+                    self._entries = content["entries"]
+            except (ValueError, KeyError, AttributeError):
+                _LOGGER.debug(f'Discarding unreadable build log "{self._path}"')
+
+    def get(self, output, key, default=None):
+        """Return the recorded value ``key`` of the job which produced ``output``."""
+        return self._entries.get(str(output), {}).get(key, default)
+
+    def record(self, output, **values):
+        """Record values for the job which produced ``output``."""
+        self._entries.setdefault(str(output), {}).update(values)
+
+    def save(self):
+        """Write the build log to disk."""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_text(
+            _json.dumps({"version": _BUILD_LOG_VERSION, "entries": self._entries})
+        )
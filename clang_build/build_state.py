@@ -0,0 +1,309 @@
+"""Module for the BuildState class."""
+
+import hashlib as _hashlib
+import logging as _logging
+import os as _os
+import pickle as _pickle
+import sys as _sys
+import time as _time
+from itertools import chain as _chain
+
+from .stat_cache import StatCache as _StatCache
+
+_LOGGER = _logging.getLogger(__name__)
+
+_BUILD_STATE_VERSION = 3
+
+# Size of the chunks in which files are read to hash their content
+_HASH_CHUNK_SIZE = 1024**2
+
+# Files modified less than this many seconds ago could be modified again
+# without a change of their modification time, so their hash is not saved
+_RACY_SECONDS = 2
+
+
+def hash_command(command, path_prefix_map=None):
+    """Return a short, stable hash of a command given as a list of strings.
+
+    Anything else which determines the output of the command, such as the
+    identity of the compiler, can be appended to the command. With a
+    :any:`PathPrefixMap`, the hash does not depend on where the project is.
+    """
+    arguments = (str(argument) for argument in command)
+    if path_prefix_map:
+        arguments = map(path_prefix_map.relocate, arguments)
+    return _hashlib.blake2b(
+        "\0".join(arguments).encode("utf8"),
+        digest_size=16,
+    ).digest()
+
+
+def hash_file(path):
+    """Return a short hash of the content of a file."""
+    file_hash = _hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as the_file:
+        for chunk in iter(lambda: the_file.read(_HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.digest()
+
+
+class BuildState:
+    """The inputs of the outputs of previous builds, kept in the build directory.
+
+    For every output (usually an object file) this records the files it was
+    built from, i.e. the source file and the headers discovered by the
+    compiler, a hash of the command which produced it and its modification
+    time. This is all that is needed to decide whether an output is up to
+    date, so that dependency files do not have to be parsed again.
+
+    By default, an output is out of date if any of its inputs is newer. With
+    ``content_hash``, it is only out of date if the content of an input
+    differs from when the output was built, so that files which were merely
+    touched (e.g. by switching branches) do not cause rebuilds. The hash of
+    every file is kept together with its inode, size and modification time,
+    and a file is only hashed again if one of these changes.
+
+    The hash of every output is recorded as well. Inputs which are outputs
+    themselves, e.g. the objects of a library, are always compared by this
+    hash, so that an output which was rebuilt, but came out byte-identical,
+    does not make the outputs depending on it out of date ("early cutoff").
+
+    The state is loaded once, updated in memory while building and written
+    back by :any:`save`. On disk, every path is stored only once in a table
+    and the entries refer to it by index.
+    """
+
+    def __init__(self, path, content_hash=False, stat_cache=None):
+        """Load the build state from ``path``, if it exists.
+
+        An unreadable or outdated state is discarded. Files are looked at
+        through the given :any:`StatCache`, or a new one.
+        """
+        self._path = path
+        self._content_hash = content_hash
+        self._stat_cache = _StatCache() if stat_cache is None else stat_cache
+        self._entries = {}
+        self._file_hashes = {}
+        self._modified = False
+        if self._path.exists():
+            try:
+                with open(self._path, "rb") as state_file:
+                    content = _pickle.load(state_file)
+                if content.get("version") == _BUILD_STATE_VERSION:
+                    paths = [_sys.intern(path) for path in content["paths"]]
+                    for entry in content["entries"]:
+                        output, inputs, *rest = entry
+                        command_hash, output_mtime, input_hashes, output_hash = rest
+                        self._entries[paths[output]] = (
+                            tuple(paths[index] for index in inputs),
+                            command_hash,
+                            output_mtime,
+                            input_hashes,
+                            output_hash,
+                        )
+                    self._file_hashes = {
+                        paths[index]: tuple(signature_and_hash)
+                        for index, *signature_and_hash in content["file_hashes"]
+                    }
+            except (
+                OSError,
+                EOFError,
+                _pickle.UnpicklingError,
+                AttributeError,
+                IndexError,
+                KeyError,
+                TypeError,
+                ValueError,
+            ):
+                _LOGGER.debug(f'Discarding unreadable build state "{self._path}"')
+
+    def prefetch(self):
+        """Stat all recorded outputs and their inputs at once, see :any:`StatCache.prefetch`."""
+        self._stat_cache.prefetch(
+            _chain(self._entries, *(entry[0] for entry in self._entries.values()))
+        )
+
+    def _hash(self, path):
+        """Return the hash of the content of an input, or None if it does not exist.
+
+        The hash is reused if the inode, size and modification time of the
+        file did not change since it was computed, also in a previous build.
+        """
+        path_stat = self._stat_cache.stat(path)
+        if path_stat is None:
+            return None
+        signature = (path_stat.st_ino, path_stat.st_size, path_stat.st_mtime_ns)
+        known = self._file_hashes.get(path)
+        if known is not None and known[:3] == signature:
+            return known[3]
+        try:
+            file_hash = hash_file(path)
+        except OSError:
+            return None
+        self._file_hashes[path] = (*signature, file_hash)
+        self._modified = True
+        return file_hash
+
+    def _input_hash(self, path):
+        """Return the hash of an input, taking the recorded hash of unmodified outputs."""
+        entry = self._entries.get(path)
+        if entry is not None and entry[4] is not None:
+            path_stat = self._stat_cache.stat(path)
+            if path_stat is not None and path_stat.st_mtime_ns == entry[2]:
+                return entry[4]
+        return self._hash(path)
+
+    def _compares_hash(self, path):
+        """Return whether an input is compared by its hash rather than its modification time."""
+        return self._content_hash or path in self._entries
+
+    def _unchanged_entry(self, output, command_hash):
+        """Return the entry of ``output`` and its modification time, if the output
+        exists, was not modified since it was recorded and, if a ``command_hash``
+        is given, was produced by the same command.
+        """
+        entry = self._entries.get(str(output))
+        if entry is None:
+            return None
+
+        if command_hash is not None and command_hash != entry[1]:
+            _LOGGER.debug(f'The command for "{output}" has changed')
+            return None
+
+        output_stat = self._stat_cache.stat(output)
+        if output_stat is None or output_stat.st_mtime_ns != entry[2]:
+            return None
+        return entry, output_stat.st_mtime_ns
+
+    def _changed_inputs(self, entry, output_mtime):
+        """Yield the inputs of an entry which changed since its output was built."""
+        inputs, _, _, input_hashes, _ = entry
+        if input_hashes is None:
+            input_hashes = (None,) * len(inputs)
+        for path, input_hash in zip(inputs, input_hashes):
+            if input_hash is not None and self._compares_hash(path):
+                if self._input_hash(path) != input_hash:
+                    yield path
+                continue
+            input_stat = self._stat_cache.stat(path)
+            if input_stat is None or input_stat.st_mtime_ns > output_mtime:
+                yield path
+
+    def needs_rebuild(self, output, command_hash=None):
+        """Return whether ``output`` is unknown, missing, or older than any of its inputs.
+
+        An output which was modified since it was recorded is also rebuilt,
+        as well as one which was produced by a command with a different
+        ``command_hash``, if one is given. With ``content_hash``, the content
+        of the inputs is compared instead of their modification times. Inputs
+        which are recorded outputs are always compared by their hash.
+        """
+        unchanged_entry = self._unchanged_entry(output, command_hash)
+        if unchanged_entry is None:
+            return True
+        return next(self._changed_inputs(*unchanged_entry), None) is not None
+
+    def changed_inputs(self, output, inputs, command_hash=None):
+        """Return those of the ``inputs`` which changed since ``output`` was built.
+
+        Returns None instead, if the output has to be built from scratch,
+        see :any:`needs_rebuild`, or if it was built from different inputs.
+        """
+        unchanged_entry = self._unchanged_entry(output, command_hash)
+        if unchanged_entry is None:
+            return None
+        if tuple(dict.fromkeys(str(path) for path in inputs)) != unchanged_entry[0][0]:
+            return None
+        return list(self._changed_inputs(*unchanged_entry))
+
+    def __contains__(self, output):
+        """Return whether ``output`` is recorded."""
+        return str(output) in self._entries
+
+    def inputs(self, output):
+        """Return the recorded inputs of ``output``, or an empty tuple if it is not known."""
+        entry = self._entries.get(str(output))
+        return () if entry is None else entry[0]
+
+    def record(self, output, inputs, command_hash, output_hash=None):
+        """Record the inputs and the command hash of the freshly built ``output``.
+
+        The content of the output is hashed, as well as that of its inputs
+        which are compared by their hash. Instead, an ``output_hash`` can be
+        given, by which the outputs depending on this one are compared, e.g.
+        a hash of the interface of a shared library.
+        """
+        self._stat_cache.invalidate(output)
+        output_stat = self._stat_cache.stat(output)
+        if output_stat is None:
+            self.forget(output)
+            return
+        if output_hash is None:
+            try:
+                output_hash = hash_file(output)
+            except OSError:
+                self.forget(output)
+                return
+        inputs = tuple(dict.fromkeys(_sys.intern(str(path)) for path in inputs))
+
+        input_hashes = tuple(
+            self._input_hash(path) if self._compares_hash(path) else None
+            for path in inputs
+        )
+        if not any(input_hashes):
+            input_hashes = None
+
+        self._entries[_sys.intern(str(output))] = (
+            inputs,
+            command_hash,
+            output_stat.st_mtime_ns,
+            input_hashes,
+            output_hash,
+        )
+        self._modified = True
+
+    def forget(self, output):
+        """Remove ``output``, so that it will be rebuilt."""
+        if self._entries.pop(str(output), None) is not None:
+            self._modified = True
+
+    def save(self):
+        """Write the build state to disk, if it was modified."""
+        if not self._modified:
+            return
+
+        path_indices = {}
+
+        def index(path):
+            return path_indices.setdefault(path, len(path_indices))
+
+        entries = [
+            (index(output), [index(path) for path in entry[0]], *entry[1:])
+            for output, entry in self._entries.items()
+        ]
+
+        # Only keep the hashes of files which are still inputs of an output.
+        # Files which were modified very recently could be modified again
+        # without a change of their modification time.
+        racy_mtime = _time.time_ns() - _RACY_SECONDS * 10**9
+        file_hashes = [
+            (path_indices[path], *signature_and_hash)
+            for path, signature_and_hash in self._file_hashes.items()
+            if path in path_indices and signature_and_hash[2] < racy_mtime
+        ]
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self._path.with_name(self._path.name + ".tmp")
+        with open(temporary_path, "wb") as state_file:
+            _pickle.dump(
+                {
+                    "version": _BUILD_STATE_VERSION,
+                    "paths": list(path_indices),
+                    "entries": entries,
+                    "file_hashes": file_hashes,
+                },
+                state_file,
+                protocol=_pickle.HIGHEST_PROTOCOL,
+            )
+        _os.replace(temporary_path, self._path)
+        self._modified = False
@@ -0,0 +1,118 @@
+"""A minimal server for the remote compile cache, see :any:`RemoteCache`.
+
+Blobs and entries are stored as files in a directory, with the same HTTP
+layout as `bazel-remote`. It is meant for tests and for trying out the
+remote cache locally::
+
+    python -m clang_build.cache_server --port 8080 --directory cache
+    clang-build --remote-cache http://localhost:8080
+"""
+
+import argparse as _argparse
+import hashlib as _hashlib
+import logging as _logging
+import os as _os
+import re as _re
+from http.server import BaseHTTPRequestHandler as _BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer as _ThreadingHTTPServer
+from pathlib import Path as _Path
+
+_LOGGER = _logging.getLogger(__name__)
+
+_KEY_PATH = _re.compile(r"^/(ac|cas)/([0-9a-f]{64})$")
+
+
+class _CacheRequestHandler(_BaseHTTPRequestHandler):
+    def _file(self):
+        """Return the file of the requested key, or None after answering a bad request."""
+        match = _KEY_PATH.match(self.path)
+        if match is None:
+            self.send_error(400, "Expected /ac/<sha256> or /cas/<sha256>")
+            return None
+        kind, key = match.groups()
+        return self.server.directory / kind / key[:2] / key
+
+    def _send(self, code, content=b""):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if content and self.command != "HEAD":
+            self.wfile.write(content)
+
+    def do_GET(self):
+        path = self._file()
+        if path is None:
+            return
+        try:
+            content = path.read_bytes()
+        except OSError:
+            self.send_error(404)
+            return
+        self._send(200, content)
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        path = self._file()
+        if path is None:
+            return
+        content = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if path.parent.parent.name == "cas":
+            if _hashlib.sha256(content).hexdigest() != path.name:
+                self.send_error(400, "The content does not match its hash")
+                return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f"{path.name}.{_os.getpid()}.{id(self)}.tmp")
+        temporary_path.write_bytes(content)
+        _os.replace(temporary_path, path)
+        self._send(200)
+
+    def log_message(self, format, *args):
+        _LOGGER.debug(format, *args)
+
+
+class CacheServer(_ThreadingHTTPServer):
+    """HTTP server of a remote compile cache, which keeps its content in ``directory``.
+
+    By default, it listens on a free port of the local host, see :any:`url`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, directory, address=("127.0.0.1", 0)):
+        self.directory = _Path(directory)
+        super().__init__(address, _CacheRequestHandler)
+
+    @property
+    def url(self):
+        """Return the URL under which the server can be reached."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def _main():
+    parser = _argparse.ArgumentParser(
+        description="Serve a remote compile cache for `clang-build`.",
+        formatter_class=_argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument(
+        "--directory",
+        type=_Path,
+        default=_Path("clang-build-cache"),
+        help="directory in which the cache is kept",
+    )
+    args = parser.parse_args()
+
+    with CacheServer(args.directory, (args.host, args.port)) as server:
+        print(f'Serving the cache in "{args.directory}" on {server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    _main()
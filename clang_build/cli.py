@@ -11,7 +11,9 @@ from multiprocessing import freeze_support as _freeze_support
 
 import clang_build as _clang_build
 from .build_type import BuildType as _BuildType
+from .compile_cache import CompileCache as _CompileCache
 from .project import Project as _Project
+from .scheduler import usable_cpu_count as _usable_cpu_count
 from .progress_bar import CategoryProgress as _CategoryProgress
 from .logging_tools import TqdmHandler as _TqdmHandler
 from .environment import Environment as _Environment
@@ -44,6 +46,45 @@ def _setup_logger(log_level=None):
         logger.addHandler(ch)
 
 
+def _parse_size(text):
+    """Parse a size in bytes, which may have a suffix K, M, G or T (powers of 1024)."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    size = text.strip().upper()
+    factor = units.get(size[-1:], 1)
+    if factor != 1:
+        size = size[:-1]
+    try:
+        return int(float(size) * factor)
+    except ValueError:
+        raise _argparse.ArgumentTypeError(f'invalid size "{text}"')
+
+
+def _format_size(size):
+    """Format a size in bytes with a binary unit."""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    return f"{size:.1f} {unit}"
+
+
+def _add_cache_arguments(parser):
+    parser.add_argument(
+        "--cache-dir",
+        type=_Path,
+        help="set the directory of the compile cache (defaults to $CLANG_BUILD_CACHE_DIR"
+        " or clang-build in the cache directory of the user)",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=_parse_size,
+        default="5G",
+        help="set the size, to which the compile cache is limited (e.g. 500M or 20G)",
+    )
+
+
 def parse_args(args):
     _command_line_description = (
         "`clang-build` is a build system to build your C++ projects. It uses the clang "
@@ -92,12 +133,57 @@ def parse_args(args):
         help="also build sources which have already been built",
         action="store_true",
     )
+    parser.add_argument(
+        "--content-hash",
+        help="rebuild sources only if the content of them or their headers changed,"
+        " instead of comparing modification times",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache",
+        help="reuse object files compiled by any previous build with the same command,"
+        " source and headers, using a local compile cache",
+        action="store_true",
+    )
+    _add_cache_arguments(parser)
+    parser.add_argument(
+        "--remote-cache",
+        metavar="URL",
+        help="also share object files through the HTTP cache at this URL, e.g. a"
+        " bazel-remote server run with `--disable_http_ac_validation`"
+        " (implies `--cache`)",
+    )
+    parser.add_argument(
+        "--remote-cache-read-only",
+        help="only download from the remote cache, but do not upload to it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--relocatable",
+        help="make object files and cache keys independent of where the project is,"
+        " using paths relative to the project root, so that different checkouts"
+        " share the compile cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--explain-cache",
+        metavar="SOURCE",
+        type=_Path,
+        help="instead of building, explain why the object file of this source is not"
+        " in the compile cache, by comparing its cache key with those of previous"
+        " compilations (implies `--cache`)",
+    )
     parser.add_argument(
         "-j",
         "--jobs",
         type=int,
-        default=1,
-        help="set the number of concurrent build jobs",
+        default=_usable_cpu_count(),
+        help="set the maximum number of concurrent compile and link jobs",
+    )
+    parser.add_argument(
+        "--link-jobs",
+        type=int,
+        help="set the maximum number of concurrent link jobs (defaults to a quarter of the jobs, at least 2)",
     )
     parser.add_argument(
         "--debug",
@@ -130,7 +216,92 @@ def parse_args(args):
         # nargs=1,
         help="specify a toolchain file to be used instead of the provided LLVM toolchain",
     )
-    return parser.parse_args(args=args)
+    parsed_args = parser.parse_args(args=args)
+    if parsed_args.jobs < 1:
+        parser.error("the number of jobs has to be at least 1")
+    if parsed_args.link_jobs is not None and parsed_args.link_jobs < 1:
+        parser.error("the number of link jobs has to be at least 1")
+    return parsed_args
+
+
+def parse_cache_args(args):
+    parser = _argparse.ArgumentParser(
+        prog="clang-build cache",
+        description="Inspect or clean the local compile cache of `clang-build`, or copy"
+        " it to other machines.",
+        formatter_class=_argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "action",
+        choices=["stats", "clean", "export", "import"],
+        help="print statistics of the cache, remove everything from it, write its"
+        " entries into an archive or add the entries of an archive to it",
+    )
+    parser.add_argument(
+        "archive",
+        nargs="?",
+        type=_Path,
+        help="the archive to export to or import from (a .tar.gz file)",
+    )
+    parser.add_argument(
+        "--build-dir",
+        type=_Path,
+        help="only export the entries behind the object files built in this build"
+        " directory (e.g. build), instead of the whole cache",
+    )
+    _add_cache_arguments(parser)
+    parsed_args = parser.parse_args(args=args)
+    if parsed_args.action in ["export", "import"] and parsed_args.archive is None:
+        parser.error(f"{parsed_args.action} needs the path of an archive")
+    return parsed_args
+
+
+def cache(args):
+    compile_cache = _CompileCache(args.cache_dir, args.cache_max_size)
+    if args.action == "clean":
+        compile_cache.clean()
+        print(f'Cleaned the compile cache in "{compile_cache.directory}"')
+        return
+    if args.action == "export":
+        used_entries_file = None
+        if args.build_dir is not None:
+            used_entries_file = args.build_dir / ".clang_build_cache_entries"
+        exported = compile_cache.export_archive(args.archive, used_entries_file)
+        print(f'Exported {exported} object file(s) to "{args.archive}"')
+        return
+    if args.action == "import":
+        imported = compile_cache.import_archive(args.archive)
+        print(
+            f"Imported {imported} object file(s) into the compile cache in"
+            f' "{compile_cache.directory}"'
+        )
+        return
+
+    stats = compile_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = f"{100 * stats['hits'] / lookups:.1f} %" if lookups else "-"
+    print(f"cache directory  {stats['directory']}")
+    print(f"cached objects   {stats['objects']}")
+    print(f"cached targets   {stats['artifacts']}")
+    print(
+        f"cache size       {_format_size(stats['size'])}"
+        f" of {_format_size(stats['max_size'])}"
+    )
+    print(f"hits             {stats['hits']} ({stats['remote_hits']} remote)")
+    print(f"misses           {stats['misses']}")
+    print(f"hit rate         {hit_rate}")
+
+
+def explain_cache(environment):
+    if not environment.cache_explanations:
+        print(f'"{environment.explain_cache}" is not a source of the project')
+    for source_file, differences in environment.cache_explanations.items():
+        if not differences:
+            print(f'"{source_file}": the cache key matches a cached object file')
+            continue
+        print(f'"{source_file}" is not in the compile cache:')
+        for difference in differences:
+            print(f"  {difference}")
 
 
 def build(args):
@@ -147,15 +318,25 @@ def build(args):
     if args.directory:
         directory = _Path(args.directory)
 
+    if args.explain_cache:
+        project = _Project.from_directory(directory, environment)
+        project.configure(args.all, args.targets)
+        explain_cache(environment)
+        return
+
     with _CategoryProgress(categories, not args.progress) as progress_bar:
         project = _Project.from_directory(directory, environment)
-        project.build(args.all, args.targets, args.jobs)
+        project.build(args.all, args.targets, args.jobs, args.link_jobs)
         progress_bar.update()
 
     _LOGGER.info("clang-build finished.")
 
 
 def _main():
+    if _sys.argv[1:2] == ["cache"]:
+        cache(parse_cache_args(_sys.argv[2:]))
+        return
+
     # Build
     try:
         args = parse_args(_sys.argv[1:])
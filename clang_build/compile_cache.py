@@ -0,0 +1,886 @@
+"""Module for the CompileCache class."""
+
+import hashlib as _hashlib
+import io as _io
+import json as _json
+import logging as _logging
+import os as _os
+import pickle as _pickle
+import re as _re
+import shutil as _shutil
+import tarfile as _tarfile
+import threading as _threading
+from collections import Counter as _Counter
+from pathlib import Path as _Path
+from sys import platform as _platform
+
+from .build_state import hash_file as _hash_file
+from .depfile import write_depfile as _write_depfile
+from .path_prefix_map import PathPrefixMap as _PathPrefixMap
+from .remote_cache import sha256 as _sha256
+
+try:
+    import fcntl as _fcntl
+except ImportError:
+    _fcntl = None
+
+_LOGGER = _logging.getLogger(__name__)
+
+_CACHE_VERSION = 3
+
+# Default limit on the size of the cache in bytes
+DEFAULT_MAX_SIZE = 5 * 1024**3
+
+# Number of different sets of headers remembered for the same command and source
+_MAX_MANIFEST_ENTRIES = 16
+
+# Number of compilations of the same source remembered to explain misses
+_MAX_KEY_RECORDS = 8
+
+# A cache which got too large is trimmed to this fraction of its maximum size,
+# so that it is not trimmed again right away by the next build
+_TRIM_FRACTION = 0.9
+
+# Keys of manifests and results, which are also the names of their files
+_RESULT_KEY = _re.compile(r"^[0-9a-f]{40}$")
+
+# Name of the index of an archive of the cache, see `CompileCache.export_archive`
+_ARCHIVE_INDEX = "index.json"
+
+# `ioctl` request which makes a file share the blocks of another one
+_FICLONE = 0x40049409 if _platform == "linux" and _fcntl is not None else None
+
+
+def default_cache_directory():
+    """Return the directory of the compile cache, unless another one is given.
+
+    This is ``$CLANG_BUILD_CACHE_DIR``, if it is set, and otherwise the
+    ``clang-build`` directory in the cache directory of the user.
+    """
+    directory = _os.environ.get("CLANG_BUILD_CACHE_DIR")
+    if directory:
+        return _Path(directory)
+    if _platform == "win32":
+        base = _os.environ.get("LOCALAPPDATA") or _Path.home() / "AppData" / "Local"
+    elif _platform == "darwin":
+        base = _Path.home() / "Library" / "Caches"
+    else:
+        base = _os.environ.get("XDG_CACHE_HOME") or _Path.home() / ".cache"
+    return _Path(base) / "clang-build"
+
+
+def _hash(*parts):
+    """Return the hex digest of a hash over the given byte strings."""
+    key_hash = _hashlib.blake2b(digest_size=20)
+    for part in parts:
+        key_hash.update(len(part).to_bytes(8, "little"))
+        key_hash.update(part)
+    return key_hash.hexdigest()
+
+
+def _remote_key(kind, key):
+    """Return the key in the remote cache of a manifest or a result."""
+    return _sha256(f"clang-build/{_CACHE_VERSION}/{kind}/{key}".encode())
+
+
+def _remove(path):
+    try:
+        _os.remove(path)
+    except OSError:
+        pass
+
+
+def _tree_size(path):
+    """Return the size of all files in a directory and its subdirectories."""
+    size = 0
+    for directory, _, files in _os.walk(path):
+        for name in files:
+            size += _os.lstat(_os.path.join(directory, name)).st_size
+    return size
+
+
+def _write_atomically(path, content):
+    """Write bytes to a file, which is never seen partially written by other builds."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.name}.{_os.getpid()}.tmp")
+    try:
+        temporary_path.write_bytes(content)
+        _os.replace(temporary_path, path)
+    except BaseException:
+        _remove(temporary_path)
+        raise
+
+
+def _copy_file(source, destination):
+    """Copy a file atomically, as a reflink where the file system supports it.
+
+    A reflink shares the blocks of the file until one of the copies is
+    modified, so it takes neither time nor space.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = destination.with_name(f"{destination.name}.{_os.getpid()}.tmp")
+    try:
+        cloned = False
+        if _FICLONE is not None:
+            with open(source, "rb") as source_file, open(
+                temporary_path, "wb"
+            ) as temporary_file:
+                try:
+                    _fcntl.ioctl(
+                        temporary_file.fileno(), _FICLONE, source_file.fileno()
+                    )
+                    cloned = True
+                except OSError:
+                    pass
+        if not cloned:
+            _shutil.copyfile(source, temporary_path)
+        _os.replace(temporary_path, destination)
+    except BaseException:
+        _remove(temporary_path)
+        raise
+
+
+def _touch(path):
+    """Mark a file as recently used, see :any:`CompileCache.trim`."""
+    try:
+        _os.utime(path)
+    except OSError:
+        pass
+
+
+class CompileCache:
+    """A local cache of object files, shared by all builds of the user.
+
+    Like `ccache` in its "direct mode", an object file is found in the cache
+    without running the compiler. A manifest, found by the hash of the
+    compile command (which contains the identity of the compiler) and the
+    content of the source file, lists the headers the source included and
+    their hashes for each object file compiled from it. If the current
+    content of all headers of an entry matches, its object file and the
+    compiler output are copied from the cache, and a dependency file is
+    written.
+
+    Only headers which are listed in the dependency file are taken into
+    account. While the cache is used, dependency files also list system
+    headers (see :any:`Toolchain.system_header_dependencies`), so that an
+    upgraded system library or another machine sharing a remote cache does
+    not get object files compiled against different headers.
+
+    With a non-empty :any:`PathPrefixMap`, the paths of headers and in the
+    compiler output are stored relative to the project root, so that
+    checkouts in different directories share the cache.
+
+    The cache is bounded by ``max_size`` bytes. When it gets larger, the
+    least recently used files are removed by :any:`trim`. The numbers of
+    hits and misses are accumulated across builds by :any:`save`.
+
+    Lookups and stores may run in multiple threads at the same time, and
+    several builds may share the cache directory.
+
+    With a :any:`RemoteCache`, an object file which is not in the local
+    cache is looked up in the remote cache the same way, and then kept in the
+    local cache. Freshly compiled object files are uploaded in the background.
+    Manifests and results are JSON entries there, which refer to the object
+    files as blobs.
+
+    The components of the keys of the last compilations of each source are
+    kept as well, so that :any:`explain` can tell why a lookup missed.
+
+    Entries can be copied to machines without access to a remote cache with
+    :any:`export_archive` and :any:`import_archive`.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        max_size=DEFAULT_MAX_SIZE,
+        remote=None,
+        path_prefix_map=None,
+    ):
+        self.directory = _Path(directory or default_cache_directory())
+        self.max_size = max_size
+        self.remote = remote
+        self.path_prefix_map = path_prefix_map or _PathPrefixMap()
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self._stored = False
+        self._lock = _threading.Lock()
+        self._file_hashes = {}
+        # The entry behind every object file of this build
+        self._used = {}
+
+    def _manifest_path(self, key):
+        return self.directory / "manifests" / key[:2] / key
+
+    def _result_path(self, key):
+        return self.directory / "results" / key[:2] / key
+
+    def _key_records_path(self, source_file):
+        key = _hash(self.path_prefix_map.relocate(str(source_file)).encode())
+        return self.directory / "keys" / key[:2] / key
+
+    def _file_hash(self, path):
+        """Return the hash of the content of a file, or None if it cannot be read.
+
+        The hash is reused while the inode, size and modification time of
+        the file do not change.
+        """
+        try:
+            path_stat = _os.stat(path)
+        except OSError:
+            return None
+        signature = (path_stat.st_ino, path_stat.st_size, path_stat.st_mtime_ns)
+        known = self._file_hashes.get(path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        try:
+            file_hash = _hash_file(path)
+        except OSError:
+            return None
+        self._file_hashes[path] = (signature, file_hash)
+        return file_hash
+
+    def _manifest_key(self, command_hash, source_file):
+        source_hash = self._file_hash(str(source_file))
+        if source_hash is None:
+            return None
+        return _hash(str(_CACHE_VERSION).encode(), command_hash, source_hash)
+
+    def _load_manifest(self, key):
+        try:
+            with open(self._manifest_path(key), "rb") as manifest_file:
+                manifest = _pickle.load(manifest_file)
+            if manifest.get("version") == _CACHE_VERSION:
+                return manifest["entries"]
+        except (OSError, EOFError, _pickle.UnpicklingError, AttributeError, KeyError):
+            pass
+        return []
+
+    def _add_to_manifest(self, manifest_key, headers, result_key):
+        entries = [
+            entry
+            for entry in self._load_manifest(manifest_key)
+            if entry[1] != result_key
+        ]
+        entries.insert(0, (headers, result_key))
+        _write_atomically(
+            self._manifest_path(manifest_key),
+            _pickle.dumps(
+                {
+                    "version": _CACHE_VERSION,
+                    "entries": entries[:_MAX_MANIFEST_ENTRIES],
+                },
+                protocol=_pickle.HIGHEST_PROTOCOL,
+            ),
+        )
+
+    def _local_headers(self, headers):
+        """Return the headers of a manifest entry with the paths of this checkout."""
+        return [
+            (self.path_prefix_map.restore(path), header_hash)
+            for path, header_hash in headers
+        ]
+
+    def _headers_match(self, headers):
+        return all(
+            self._file_hash(path) == header_hash
+            for path, header_hash in self._local_headers(headers)
+        )
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _use(self, object_file, manifest_key, result_key):
+        with self._lock:
+            self._used[str(object_file)] = [manifest_key, result_key]
+
+    def lookup(self, command_hash, source_file, object_file, depfile):
+        """Copy the object file for a compilation from the cache and write its dependency file.
+
+        Parameters
+        ----------
+        command_hash : bytes
+            Hash of the compile command and the identity of the compiler
+        source_file : pathlib.Path
+            The source file to compile
+        object_file : pathlib.Path
+            Where the object file should be written
+        depfile : pathlib.Path
+            Where the dependency file should be written
+
+        Returns
+        -------
+        str
+            The output of the compiler, or None if the object file is not in
+            the cache
+
+        """
+        manifest_key = self._manifest_key(command_hash, source_file)
+        output = None
+        if manifest_key is not None:
+            output = self._lookup_local(manifest_key, source_file, object_file, depfile)
+            if output is None and self.remote is not None:
+                output = self._lookup_remote(
+                    manifest_key, source_file, object_file, depfile
+                )
+        self._count("misses" if output is None else "hits")
+        return output
+
+    def _lookup_local(self, manifest_key, source_file, object_file, depfile):
+        for headers, result_key in self._load_manifest(manifest_key):
+            if self._headers_match(headers):
+                output = self._restore(
+                    result_key, headers, source_file, object_file, depfile
+                )
+                if output is not None:
+                    _touch(self._manifest_path(manifest_key))
+                    self._use(object_file, manifest_key, result_key)
+                return output
+        return None
+
+    def _lookup_remote(self, manifest_key, source_file, object_file, depfile):
+        entries = self.remote.get_entry(_remote_key("manifest", manifest_key))
+        for entry in entries if isinstance(entries, list) else []:
+            try:
+                headers = tuple(
+                    (path, bytes.fromhex(header_hash))
+                    for path, header_hash in entry["headers"]
+                )
+                result_key = entry["result"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            if not _RESULT_KEY.match(str(result_key)) or not self._headers_match(
+                headers
+            ):
+                continue
+
+            result = self.remote.get_entry(_remote_key("result", result_key))
+            try:
+                object_content = self.remote.get_blob(result["object"])
+                output = str(result["output"])
+            except (KeyError, TypeError):
+                return None
+            if object_content is None:
+                return None
+
+            # Keep the result in the local cache, for the next builds
+            result_path = self._result_path(result_key)
+            try:
+                _write_atomically(result_path / "object", object_content)
+                _write_atomically(result_path / "output", output.encode())
+                self._add_to_manifest(manifest_key, headers, result_key)
+            except OSError:
+                return None
+            self._stored = True
+            self._count("remote_hits")
+            output = self._restore(
+                result_key, headers, source_file, object_file, depfile
+            )
+            if output is not None:
+                self._use(object_file, manifest_key, result_key)
+            return output
+        return None
+
+    def _restore(self, result_key, headers, source_file, object_file, depfile):
+        result_path = self._result_path(result_key)
+        try:
+            output = (result_path / "output").read_bytes().decode()
+            _copy_file(result_path / "object", object_file)
+            _write_depfile(
+                depfile,
+                object_file,
+                [str(source_file)] + [path for path, _ in self._local_headers(headers)],
+            )
+        except (OSError, UnicodeDecodeError):
+            return None
+        _touch(result_path)
+        _LOGGER.debug(f'Restored "{object_file}" from the compile cache')
+        return self.path_prefix_map.restore(output)
+
+    def store(
+        self,
+        command_hash,
+        source_file,
+        object_file,
+        inputs,
+        output,
+        compile_start,
+        command=None,
+        compiler=None,
+    ):
+        """Store a freshly compiled object file in the cache.
+
+        Parameters
+        ----------
+        command_hash : bytes
+            Hash of the compile command and the identity of the compiler
+        source_file : pathlib.Path
+            The compiled source file
+        object_file : pathlib.Path
+            The object file
+        inputs : list of str
+            The source file and the headers it included, from the dependency file
+        output : str
+            The output of the compiler
+        compile_start : int
+            Time in nanoseconds since the epoch, when the compiler was started.
+            Nothing is stored if an input was modified since then, because the
+            compiler may have seen a different version of it.
+        command : list of str, optional
+            The compile command, which is part of ``command_hash``. It is
+            remembered together with the compiler, to explain later misses.
+        compiler : list of str, optional
+            The identity of the compiler, which is part of ``command_hash``
+
+        """
+        manifest_key = self._manifest_key(command_hash, source_file)
+        if manifest_key is None:
+            return
+
+        headers = []
+        for path in [str(source_file), *inputs]:
+            file_hash = self._file_hash(path)
+            if file_hash is None or self._file_hashes[path][0][2] >= compile_start:
+                return
+            if path != str(source_file):
+                headers.append((self.path_prefix_map.relocate(path), file_hash))
+        headers = tuple(dict.fromkeys(headers))
+        output = self.path_prefix_map.relocate(output)
+
+        result_key = _hash(
+            manifest_key.encode(),
+            *(
+                part
+                for path, file_hash in headers
+                for part in (path.encode(), file_hash)
+            ),
+        )
+        result_path = self._result_path(result_key)
+        try:
+            _copy_file(object_file, result_path / "object")
+            _write_atomically(result_path / "output", output.encode())
+            self._add_to_manifest(manifest_key, headers, result_key)
+        except OSError as error:
+            _LOGGER.debug(
+                f'Could not store "{object_file}" in the compile cache: {error}'
+            )
+            return
+        self._stored = True
+        self._use(object_file, manifest_key, result_key)
+
+        if command is not None:
+            self._record_key(
+                source_file,
+                {
+                    "compiler": list(compiler or []),
+                    "command": [
+                        self.path_prefix_map.relocate(str(argument))
+                        for argument in command
+                    ],
+                    "source": self._file_hash(str(source_file)).hex(),
+                    "headers": [
+                        [path, header_hash.hex()] for path, header_hash in headers
+                    ],
+                },
+            )
+
+        if self.remote is not None:
+            self.remote.upload(self._upload, manifest_key, headers, result_key, output)
+
+    def _upload(self, manifest_key, headers, result_key, output):
+        """Upload a result of the local cache and add it to the remote manifest."""
+        result_path = self._result_path(result_key)
+        self.remote.put_entry(
+            _remote_key("result", result_key),
+            {
+                "object": self.remote.put_blob((result_path / "object").read_bytes()),
+                "output": output,
+            },
+        )
+
+        # Other builds may have added entries since the lookup
+        key = _remote_key("manifest", manifest_key)
+        entries = self.remote.get_entry(key)
+        entries = [
+            entry
+            for entry in (entries if isinstance(entries, list) else [])
+            if isinstance(entry, dict) and entry.get("result") != result_key
+        ]
+        entries.insert(
+            0,
+            {
+                "headers": [[path, header_hash.hex()] for path, header_hash in headers],
+                "result": result_key,
+            },
+        )
+        self.remote.put_entry(key, entries[:_MAX_MANIFEST_ENTRIES])
+
+    def _load_key_records(self, source_file):
+        try:
+            records = _json.loads(self._key_records_path(source_file).read_text())
+        except (OSError, ValueError):
+            return []
+        return [record for record in records if isinstance(record, dict)]
+
+    def _record_key(self, source_file, record):
+        """Remember the components of the key of a stored object file."""
+        records = [
+            previous
+            for previous in self._load_key_records(source_file)
+            if previous != record
+        ]
+        records.insert(0, record)
+        try:
+            _write_atomically(
+                self._key_records_path(source_file),
+                _json.dumps(records[:_MAX_KEY_RECORDS]).encode(),
+            )
+        except OSError as error:
+            _LOGGER.debug(f'Could not record the cache key of "{source_file}": {error}')
+
+    def _differences(self, record, command, compiler, source_hash):
+        """Return the differences of the current key from a recorded one."""
+        differences = []
+        if record.get("compiler") != compiler:
+            differences.append(
+                "compiler changed from "
+                + " ".join(record.get("compiler") or ["?"])
+                + " to "
+                + " ".join(compiler)
+            )
+
+        previous = _Counter(record.get("command") or [])
+        current = _Counter(command)
+        for argument in (previous - current).elements():
+            differences.append(f"flag {argument} removed")
+        for argument in (current - previous).elements():
+            differences.append(f"flag {argument} added")
+
+        if record.get("source") != source_hash:
+            differences.append("source changed")
+
+        for path, header_hash in record.get("headers") or []:
+            local_path = self.path_prefix_map.restore(path)
+            current_hash = self._file_hash(local_path)
+            if current_hash is None:
+                differences.append(f"header {path} is missing")
+            elif current_hash.hex() != header_hash:
+                differences.append(f"header {path} changed")
+        return differences
+
+    def explain(self, source_file, command, compiler):
+        """Explain why the object file of a source is (not) found in the cache.
+
+        The current key is compared with the keys of the previous
+        compilations of the source, which were stored in the cache. The
+        headers are those the source included back then.
+
+        Parameters
+        ----------
+        source_file : pathlib.Path
+            The source file
+        command : list of str
+            The current compile command
+        compiler : list of str
+            The current identity of the compiler
+
+        Returns
+        -------
+        list of str
+            The differences from the closest previous key. If there are
+            none, the object file is in the cache, unless it was trimmed.
+
+        """
+        source_hash = self._file_hash(str(source_file))
+        if source_hash is None:
+            return [f'the source "{source_file}" cannot be read']
+        records = self._load_key_records(source_file)
+        if not records:
+            return ["the source was never stored in the cache"]
+
+        command = [self.path_prefix_map.relocate(str(argument)) for argument in command]
+        return min(
+            (
+                self._differences(record, command, list(compiler), source_hash.hex())
+                for record in records
+            ),
+            key=len,
+        )
+
+    def _stats_path(self):
+        return self.directory / "stats.json"
+
+    def _load_stats(self):
+        try:
+            return _json.loads(self._stats_path().read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, used_entries_file=None):
+        """Add the hits and misses of this build to the statistics and trim the cache.
+
+        Waits for the uploads to the remote cache to finish first.
+
+        Parameters
+        ----------
+        used_entries_file : pathlib.Path, optional
+            File in the build directory, to which the entries behind the
+            object files of the build are added (see :any:`export_archive`)
+
+        """
+        if self.remote is not None:
+            self.remote.wait()
+        if used_entries_file is not None and self._used:
+            self._save_used_entries(used_entries_file)
+        if not (self.hits or self.misses):
+            return
+        _LOGGER.info(
+            f"Compile cache: {self.hits} hit(s)"
+            + (f" ({self.remote_hits} remote)" if self.remote is not None else "")
+            + f", {self.misses} miss(es)"
+        )
+        stats = self._load_stats()
+        for counter in ["hits", "remote_hits", "misses"]:
+            stats[counter] = stats.get(counter, 0) + getattr(self, counter)
+        try:
+            _write_atomically(self._stats_path(), _json.dumps(stats).encode())
+        except OSError as error:
+            _LOGGER.debug(
+                f"Could not save the statistics of the compile cache: {error}"
+            )
+        self.hits = self.remote_hits = self.misses = 0
+
+        if self._stored:
+            self.trim()
+            self._stored = False
+
+    def _save_used_entries(self, used_entries_file):
+        try:
+            used = _json.loads(used_entries_file.read_text())
+        except (OSError, ValueError):
+            used = {}
+        if not isinstance(used, dict):
+            used = {}
+        with self._lock:
+            used.update(self._used)
+            self._used = {}
+        try:
+            _write_atomically(used_entries_file, _json.dumps(used, indent=1).encode())
+        except OSError as error:
+            _LOGGER.debug(
+                f"Could not save the used entries of the compile cache: {error}"
+            )
+
+    def _manifest_keys(self):
+        directory = self.directory / "manifests"
+        if not directory.is_dir():
+            return []
+        return [
+            entry.name
+            for shard in _os.scandir(directory)
+            if shard.is_dir()
+            for entry in _os.scandir(shard.path)
+            if _RESULT_KEY.match(entry.name)
+        ]
+
+    def export_archive(self, archive, used_entries_file=None):
+        """Write entries of the cache into a compressed tar archive.
+
+        The archive contains an index of the entries, i.e. the keys of their
+        manifests, the headers and hashes they depend on and the keys of
+        their results, and the object file and compiler output of each
+        result. See :any:`import_archive`.
+
+        Parameters
+        ----------
+        archive : pathlib.Path
+            The archive to write
+        used_entries_file : pathlib.Path, optional
+            If given, only the entries recorded by :any:`save` in this file
+            are exported, i.e. those behind the object files of a build.
+            Otherwise, the whole cache is exported.
+
+        Returns
+        -------
+        int
+            The number of exported entries
+
+        """
+        if used_entries_file is not None:
+            try:
+                used = _json.loads(_Path(used_entries_file).read_text()).values()
+            except (OSError, ValueError, AttributeError) as error:
+                raise RuntimeError(
+                    f'Could not read the used entries "{used_entries_file}": {error}'
+                )
+            wanted = {}
+            for manifest_key, result_key in used:
+                wanted.setdefault(manifest_key, set()).add(result_key)
+        else:
+            wanted = {key: None for key in self._manifest_keys()}
+
+        index = []
+        with _tarfile.open(archive, "w:gz") as tar:
+            for manifest_key, result_keys in sorted(wanted.items()):
+                for headers, result_key in self._load_manifest(manifest_key):
+                    if result_keys is not None and result_key not in result_keys:
+                        continue
+                    result_path = self._result_path(result_key)
+                    try:
+                        for name in ["object", "output"]:
+                            tar.add(
+                                result_path / name,
+                                arcname=f"results/{result_key}/{name}",
+                            )
+                    except OSError:
+                        continue
+                    index.append(
+                        {
+                            "manifest": manifest_key,
+                            "headers": [
+                                [path, header_hash.hex()]
+                                for path, header_hash in headers
+                            ],
+                            "result": result_key,
+                        }
+                    )
+
+            content = _json.dumps(
+                {"version": _CACHE_VERSION, "entries": index}
+            ).encode()
+            info = _tarfile.TarInfo(_ARCHIVE_INDEX)
+            info.size = len(content)
+            tar.addfile(info, _io.BytesIO(content))
+        return len(index)
+
+    def import_archive(self, archive):
+        """Add the entries of an archive written by :any:`export_archive` to the cache.
+
+        Entries of other versions of the cache are skipped.
+
+        Parameters
+        ----------
+        archive : pathlib.Path
+            The archive to read
+
+        Returns
+        -------
+        int
+            The number of imported entries
+
+        """
+        with _tarfile.open(archive, "r:*") as tar:
+            try:
+                index = _json.loads(tar.extractfile(_ARCHIVE_INDEX).read())
+            except (KeyError, AttributeError, ValueError) as error:
+                raise RuntimeError(
+                    f'"{archive}" is not an archive of the cache: {error}'
+                )
+            if index.get("version") != _CACHE_VERSION:
+                _LOGGER.warning(
+                    f'"{archive}" was written by another version of the cache'
+                )
+                return 0
+
+            imported = 0
+            for entry in index.get("entries", []):
+                try:
+                    manifest_key = entry["manifest"]
+                    result_key = entry["result"]
+                    headers = tuple(
+                        (path, bytes.fromhex(header_hash))
+                        for path, header_hash in entry["headers"]
+                    )
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if not (
+                    _RESULT_KEY.match(str(manifest_key))
+                    and _RESULT_KEY.match(str(result_key))
+                ):
+                    continue
+
+                result_path = self._result_path(result_key)
+                try:
+                    for name in ["object", "output"]:
+                        member = tar.extractfile(f"results/{result_key}/{name}")
+                        _write_atomically(result_path / name, member.read())
+                    self._add_to_manifest(manifest_key, headers, result_key)
+                except (KeyError, AttributeError, OSError):
+                    continue
+                imported += 1
+
+        if imported:
+            self.trim()
+        return imported
+
+    def _entries(self):
+        """Return the path, size and time of last use of every file of the cache."""
+        entries = []
+        for kind in ["manifests", "results", "keys", "artifacts"]:
+            kind_directory = self.directory / kind
+            if not kind_directory.is_dir():
+                continue
+            for shard in _os.scandir(kind_directory):
+                if not shard.is_dir():
+                    continue
+                for entry in _os.scandir(shard.path):
+                    try:
+                        used = entry.stat().st_mtime
+                        if kind == "artifacts":
+                            size = _tree_size(entry.path)
+                        elif entry.is_dir():
+                            size = sum(
+                                item.stat().st_size for item in _os.scandir(entry.path)
+                            )
+                        else:
+                            size = entry.stat().st_size
+                    except OSError:
+                        continue
+                    entries.append((entry.path, size, used))
+        return entries
+
+    def trim(self):
+        """Remove the least recently used files, until the cache fits into its maximum size."""
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        if size <= self.max_size:
+            return
+        target_size = self.max_size * _TRIM_FRACTION
+        for path, entry_size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if size <= target_size:
+                break
+            if _os.path.isdir(path):
+                _shutil.rmtree(path, ignore_errors=True)
+            else:
+                _remove(path)
+            size -= entry_size
+        _LOGGER.info(f"Trimmed the compile cache to {size / 1024**2:.1f} MiB")
+
+    def stats(self):
+        """Return the number of cached objects, the size and the hits and misses of the cache."""
+        entries = self._entries()
+        stats = self._load_stats()
+        results_directory = str(self.directory / "results") + _os.sep
+        artifacts_directory = str(self.directory / "artifacts") + _os.sep
+        return {
+            "directory": str(self.directory),
+            "objects": sum(
+                1 for path, _, _ in entries if path.startswith(results_directory)
+            ),
+            "artifacts": sum(
+                1 for path, _, _ in entries if path.startswith(artifacts_directory)
+            ),
+            "size": sum(entry[1] for entry in entries),
+            "max_size": self.max_size,
+            "hits": stats.get("hits", 0),
+            "remote_hits": stats.get("remote_hits", 0),
+            "misses": stats.get("misses", 0),
+        }
+
+    def clean(self):
+        """Remove everything from the cache, including its statistics."""
+        for kind in ["manifests", "results", "keys", "artifacts"]:
+            _shutil.rmtree(self.directory / kind, ignore_errors=True)
+        _remove(self._stats_path())
@@ -0,0 +1,206 @@
+"""Module for the ConfigurationCache class."""
+
+import glob as _glob
+import json as _json
+import logging as _logging
+import os as _os
+import pickle as _pickle
+from copy import deepcopy as _deepcopy
+from pathlib import Path as _Path
+
+import toml as _toml
+
+from .io_tools import get_sources_and_headers as _get_sources_and_headers
+from .stat_cache import StatCache as _StatCache
+
+_LOGGER = _logging.getLogger(__name__)
+
+_CONFIGURATION_CACHE_VERSION = 1
+
+
+def _file_signature(path_stat):
+    """Return the size and modification time of a file, or None if it does not exist."""
+    if path_stat is None:
+        return None
+    return (path_stat.st_size, path_stat.st_mtime_ns)
+
+
+def _directory_signature(path_stat):
+    """Return the modification time of a directory, which changes with its entries, or None."""
+    if path_stat is None:
+        return None
+    return path_stat.st_mtime_ns
+
+
+def _searched_directories(pattern):
+    """Return the directories, whose entries determine the matches of a glob pattern.
+
+    These are the directory before the first wildcard and the directories
+    matched by every following part of the pattern but the last. With a
+    recursive wildcard ``**``, all subdirectories are searched, except for
+    hidden ones, which are not matched by ``**`` either.
+    """
+    parts = _Path(pattern).parts
+    for index, part in enumerate(parts):
+        if _glob.has_magic(part):
+            static, rest = parts[:index], parts[index:]
+            break
+    else:
+        static, rest = parts[:-1], parts[-1:]
+    prefix = _os.path.join(*static) if static else _os.curdir
+
+    if "**" in rest:
+        directories = [prefix]
+        for directory, subdirectories, _ in _os.walk(prefix):
+            subdirectories[:] = [
+                name for name in subdirectories if not name.startswith(".")
+            ]
+            directories += [_os.path.join(directory, name) for name in subdirectories]
+        return directories
+
+    directories = [prefix]
+    for index in range(1, len(rest)):
+        directories += [
+            path
+            for path in _glob.iglob(_os.path.join(prefix, *rest[:index]))
+            if _os.path.isdir(path)
+        ]
+    return directories
+
+
+class ConfigurationCache:
+    """The configuration of projects and the files found for their targets, kept in the build directory.
+
+    Loading a project parses the ``clang-build.toml`` of every (sub)project
+    and searches the directories of every target for sources and headers.
+    Both are cached: a configuration as long as its file did not change, the
+    files of a target as long as none of the directories searched for them
+    changed, i.e. no entry was added, removed or renamed in them.
+
+    The whole cache is discarded, if it was written by another version of
+    clang-build or for other arguments affecting the configuration, such as
+    the project directory, build type, toolchain or targets.
+
+    Projects configured by a ``clang-build.py`` are not cached, since the
+    script may depend on anything.
+    """
+
+    def __init__(self, path, key, stat_cache=None):
+        """Load the configuration cache from ``path``, if it was written for ``key``.
+
+        Files are looked at through the given :any:`StatCache`, or a new one.
+        """
+        self._path = path
+        self._key = key
+        self._stat_cache = _StatCache() if stat_cache is None else stat_cache
+        self._configs = {}
+        self._files = {}
+        self._modified = False
+        if self._path.exists():
+            try:
+                with open(self._path, "rb") as cache_file:
+                    content = _pickle.load(cache_file)
+                if (
+                    content.get("version") == _CONFIGURATION_CACHE_VERSION
+                    and content.get("key") == self._key
+                ):
+                    self._configs = dict(content["configs"])
+                    self._files = dict(content["files"])
+            except (
+                OSError,
+                EOFError,
+                _pickle.UnpicklingError,
+                AttributeError,
+                KeyError,
+                TypeError,
+                ValueError,
+            ):
+                _LOGGER.debug(
+                    f'Discarding unreadable configuration cache "{self._path}"'
+                )
+
+    def load_toml(self, toml_file):
+        """Return the configuration in a ``clang-build.toml``, which is parsed only if it changed."""
+        path = _os.path.abspath(toml_file)
+        signature = _file_signature(self._stat_cache.stat(path))
+        entry = self._configs.get(path)
+        if entry is not None and entry[0] == signature:
+            return _deepcopy(entry[1])
+
+        config = _toml.load(toml_file)
+        self._configs[path] = (signature, _deepcopy(config))
+        self._modified = True
+        return config
+
+    def get_sources_and_headers(
+        self,
+        target_name,
+        platform,
+        target_options,
+        target_root_directory,
+        target_build_directory,
+    ):
+        """Return the files of a target, see :any:`get_sources_and_headers`, which are searched only if a searched directory changed."""
+        key = _json.dumps(
+            [
+                target_name,
+                platform,
+                target_options,
+                str(target_root_directory),
+                str(target_build_directory),
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        entry = self._files.get(key)
+        if entry is not None and all(
+            _directory_signature(self._stat_cache.stat(directory)) == signature
+            for directory, signature in entry[0]
+        ):
+            return {kind: list(paths) for kind, paths in entry[1].items()}
+
+        patterns = []
+        files = _get_sources_and_headers(
+            target_name,
+            platform,
+            target_options,
+            target_root_directory,
+            target_build_directory,
+            self._stat_cache,
+            patterns,
+        )
+        directories = dict.fromkeys(
+            directory
+            for pattern in patterns
+            for directory in _searched_directories(pattern)
+        )
+        self._files[key] = (
+            tuple(
+                (directory, _directory_signature(self._stat_cache.stat(directory)))
+                for directory in directories
+            ),
+            {kind: list(paths) for kind, paths in files.items()},
+        )
+        self._modified = True
+        return files
+
+    def save(self):
+        """Write the configuration cache to disk, if it was modified."""
+        if not self._modified:
+            return
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self._path.with_name(self._path.name + ".tmp")
+        with open(temporary_path, "wb") as cache_file:
+            _pickle.dump(
+                {
+                    "version": _CONFIGURATION_CACHE_VERSION,
+                    "key": self._key,
+                    "configs": self._configs,
+                    "files": self._files,
+                },
+                cache_file,
+                protocol=_pickle.HIGHEST_PROTOCOL,
+            )
+        _os.replace(temporary_path, self._path)
+        self._modified = False
@@ -0,0 +1,103 @@
+"""Parser for the Makefile-style dependency files written by the compiler.
+
+See e.g. https://gcc.gnu.org/onlinedocs/gcc/Preprocessor-Options.html for
+how they are written.
+"""
+
+import os as _os
+import re as _re
+import sys as _sys
+
+# A word of a rule, in which spaces and other characters may be escaped by
+# a backslash. Backslashes before other characters (e.g. Windows path
+# separators) are kept as they are.
+_WORD = _re.compile(r"(?:\\.|[^\s\\])+")
+
+
+def _unescape(word):
+    if "\\" in word:
+        word = word.replace("\\ ", " ").replace("\\#", "#")
+    if "$$" in word:
+        word = word.replace("$$", "$")
+    return word
+
+
+def _escape(word):
+    return word.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def parse_depfile_text(text):
+    """Return the prerequisites of all rules in the text of a dependency file.
+
+    Continuation lines, escaped spaces and rules without prerequisites
+    (as written by ``-MP``) are handled. Every prerequisite is only returned
+    once, in order of appearance.
+
+    Returns
+    -------
+    list of str
+        The prerequisites, i.e. the source file and the headers it includes
+
+    """
+    text = text.replace("\\\r\n", " ").replace("\\\n", " ")
+    escaped = "\\" in text or "$$" in text
+    words = _WORD.findall(text) if escaped else text.split()
+
+    # Every word ending in a colon is a target (the colon may also be a word
+    # of its own) and everything after the first target is a prerequisite
+    for index, word in enumerate(words):
+        if word.endswith(":"):
+            break
+    else:
+        return []
+    prerequisites = (word for word in words[index + 1 :] if not word.endswith(":"))
+    if escaped:
+        prerequisites = map(_unescape, prerequisites)
+
+    return list(map(_sys.intern, dict.fromkeys(prerequisites)))
+
+
+def parse_depfile(depfile, stat_cache):
+    """Return the resolved prerequisites of the rules in a dependency file.
+
+    Relative paths are taken to be relative to the current working
+    directory, in which the compiler is run. Symbolic links are resolved
+    for the directories only, each of them only once per ``stat_cache``.
+
+    Returns
+    -------
+    list of str
+        The absolute paths of the source file and the headers it includes
+
+    """
+    with open(depfile, "r") as the_file:
+        prerequisites = parse_depfile_text(the_file.read())
+
+    resolved = []
+    for path in prerequisites:
+        directory, name = _os.path.split(path)
+        resolved.append(
+            _sys.intern(_os.path.join(stat_cache.realpath(directory), name))
+        )
+    return resolved
+
+
+def write_depfile(depfile, target, prerequisites):
+    """Write a dependency file with a single rule, as the compiler would.
+
+    Parameters
+    ----------
+    depfile : pathlib.Path
+        The dependency file to write
+    target : str or pathlib.Path
+        The target of the rule, i.e. the object file
+    prerequisites : list of str
+        The source file and the headers it includes
+
+    """
+    lines = [f"{_escape(str(target))}:"] + [
+        f"  {_escape(str(path))}" for path in prerequisites
+    ]
+    depfile.parent.mkdir(parents=True, exist_ok=True)
+    with open(depfile, "w") as the_file:
+        the_file.write(" \\\n".join(lines) + "\n")
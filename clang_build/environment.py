@@ -10,7 +10,18 @@ from importlib import util as importlib_util
 import json
 
 from . import __version__
+from .artifact_cache import ArtifactCache as _ArtifactCache
+from .build_log import BuildLog as _BuildLog
+from .build_state import BuildState as _BuildState
 from .build_type import BuildType as _BuildType
+from .compile_cache import CompileCache as _CompileCache
+from .configuration_cache import ConfigurationCache as _ConfigurationCache
+from .compile_cache import DEFAULT_MAX_SIZE as _DEFAULT_CACHE_MAX_SIZE
+from .path_prefix_map import PathPrefixMap as _PathPrefixMap
+from .probe_cache import ProbeCache as _ProbeCache
+from .remote_cache import RemoteCache as _RemoteCache
+from .stat_cache import StatCache as _StatCache
+from .target_state import TargetState as _TargetState
 from .toolchain import Toolchain as _Toolchain
 from .toolchain import LLVM as _LLVM
 
@@ -46,26 +57,6 @@ class Environment:
         # TODO: Move this out
         _LOGGER.info(f"clang-build {__version__}")
 
-        # Toolchain
-        self.toolchain = None
-        toolchain_file_str = args.get("toolchain", None)
-        _LOGGER.info(f'toolchain_file_str "{toolchain_file_str}"')
-        if toolchain_file_str:
-            toolchain_file = _Path(toolchain_file_str)
-            if toolchain_file.is_file():
-                _LOGGER.info(f'Using toolchain file "{toolchain_file.resolve()}"')
-                self.toolchain = _get_toolchain(toolchain_file)
-                if not isinstance(self.toolchain, _Toolchain):
-                    raise RuntimeError(
-                        f'Unable to initialize toolchain:\nThe `get_toolchain` method in "{toolchain_file_str}" did not return a valid `clang_build.toolchain.Toolchain`, its type is "{type(self.toolchain)}"'
-                    )
-            else:
-                _LOGGER.error('Could not find toolchain file "{toolchain_file_str}"')
-
-        if not self.toolchain:
-            _LOGGER.info("Using default LLVM toolchain")
-            self.toolchain = _LLVM()
-
         # Build type (Default, Release, Debug)
         self.build_type = args.get("build_type", _BuildType.Default)
         _LOGGER.info(f"Build type: {self.build_type.name}")
@@ -95,6 +86,130 @@ class Environment:
             self.bundle = True
             _LOGGER.info("Redistributable bundling of binary dependencies is activated")
 
+        # Statistics of the jobs of previous builds
+        self.build_log = _BuildLog(self.build_directory / ".clang_build_log")
+
+        # Whether to compare the content of sources instead of their modification times
+        self.content_hash = args.get("content_hash", False)
+        if self.content_hash:
+            _LOGGER.info("Up-to-date checks compare the content of files")
+
+        # Status of the files looked at during a build
+        self.stat_cache = _StatCache()
+
+        # Inputs of the object files of previous builds
+        self.build_state = _BuildState(
+            self.build_directory / ".clang_build_deps",
+            self.content_hash,
+            self.stat_cache,
+        )
+
+        # Parsed project files and the files found for targets by previous
+        # runs with the same version and configuration-relevant arguments
+        self.configuration_cache = _ConfigurationCache(
+            self.build_directory / ".clang_build_config",
+            json.dumps(
+                [__version__]
+                + [
+                    args.get(name)
+                    for name in [
+                        "directory",
+                        "build_type",
+                        "toolchain",
+                        "all",
+                        "targets",
+                        "no_recursive_clone",
+                    ]
+                ],
+                default=str,
+            ),
+            self.stat_cache,
+        )
+
+        # Fingerprints of the targets of previous builds
+        self.target_state = _TargetState(
+            self.build_directory / ".clang_build_targets", self.stat_cache
+        )
+
+        # Whether objects and cache keys should not depend on where the project is
+        self.relocatable = args.get("relocatable", False)
+        self.path_prefix_map = _PathPrefixMap()
+        if self.relocatable:
+            self.path_prefix_map = _PathPrefixMap.for_project(
+                args.get("directory") or _Path()
+            )
+            _LOGGER.info(
+                "Paths are relative to the project root: "
+                + ", ".join(
+                    f'"{prefix}" -> "{name}"' for prefix, name in self.path_prefix_map
+                )
+            )
+
+        # Object files shared with other developers and CI, which are kept in
+        # the local compile cache as well
+        remote_cache = None
+        remote_cache_url = args.get("remote_cache", None)
+        if remote_cache_url:
+            remote_cache = _RemoteCache(
+                remote_cache_url, args.get("remote_cache_read_only", False)
+            )
+            _LOGGER.info(f'Using the remote cache "{remote_cache_url}"')
+
+        # A source, for which the build only explains why its object file is
+        # (not) in the compile cache
+        self.explain_cache = None
+        self.cache_explanations = {}
+        if args.get("explain_cache"):
+            self.explain_cache = _Path(args["explain_cache"]).resolve()
+
+        # Object files of previous builds, shared by all projects
+        self.compile_cache = None
+        if (
+            args.get("cache", False)
+            or remote_cache is not None
+            or self.explain_cache is not None
+        ):
+            self.compile_cache = _CompileCache(
+                args.get("cache_dir"),
+                args.get("cache_max_size") or _DEFAULT_CACHE_MAX_SIZE,
+                remote_cache,
+                self.path_prefix_map,
+            )
+            _LOGGER.info(f'Using the compile cache in "{self.compile_cache.directory}"')
+
+        # Toolchain, whose compiler features are kept in the build directory
+        probe_cache = _ProbeCache(self.build_directory / ".clang_build_toolchains")
+        self.toolchain = None
+        toolchain_file_str = args.get("toolchain", None)
+        _LOGGER.info(f'toolchain_file_str "{toolchain_file_str}"')
+        if toolchain_file_str:
+            toolchain_file = _Path(toolchain_file_str)
+            if toolchain_file.is_file():
+                _LOGGER.info(f'Using toolchain file "{toolchain_file.resolve()}"')
+                self.toolchain = _get_toolchain(toolchain_file)
+                if not isinstance(self.toolchain, _Toolchain):
+                    raise RuntimeError(
+                        f'Unable to initialize toolchain:\nThe `get_toolchain` method in "{toolchain_file_str}" did not return a valid `clang_build.toolchain.Toolchain`, its type is "{type(self.toolchain)}"'
+                    )
+            else:
+                _LOGGER.error('Could not find toolchain file "{toolchain_file_str}"')
+
+        if not self.toolchain:
+            _LOGGER.info("Using default LLVM toolchain")
+            self.toolchain = _LLVM(probe_cache)
+
+        if self.compile_cache is not None:
+            self.toolchain.system_header_dependencies = True
+
+        # Sources and outputs of external targets, which are kept in the
+        # compile cache
+        self.artifact_cache = None
+        if self.compile_cache is not None:
+            self.artifact_cache = _ArtifactCache(
+                self.compile_cache.directory / "artifacts",
+                _PathPrefixMap.for_project(args.get("directory") or _Path()),
+            )
+
         self.compilation_database_file = self.build_directory / "compile_commands.json"
         self.compilation_database = []
         if self.compilation_database_file.exists():
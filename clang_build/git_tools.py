@@ -1,6 +1,13 @@
 import logging as _logging
+import re as _re
 import subprocess as _subprocess
 
+# Seconds to wait for `git ls-remote`, before a commit is considered unknown
+_LS_REMOTE_TIMEOUT = 30
+
+# Full hashes of commits, which do not have to be resolved
+_COMMIT = _re.compile(r"^[0-9a-fA-F]{40}$")
+
 
 def needs_download(url, download_directory, logger, version=None):
     if download_directory.exists():
@@ -119,3 +126,55 @@ def download_sources(url, directory, logger, version=None, clone_recursively=Tru
     # Otherwise we download the sources
     else:
         logger.debug(f"external sources found in '{str(directory.resolve())}'")
+
+
+def resolve_commit(url, version=None):
+    """Return the commit, which a branch, tag or the default branch of a remote repository points to.
+
+    The remote is asked with ``git ls-remote``, without cloning it.
+
+    Returns
+    -------
+    str
+        The hash of the commit, or None if it cannot be resolved, e.g.
+        without network access or for abbreviated commit hashes
+
+    """
+    if version and _COMMIT.match(version):
+        return version.lower()
+    try:
+        output = _subprocess.run(
+            ["git", "ls-remote", url, version or "HEAD"],
+            stdout=_subprocess.PIPE,
+            stderr=_subprocess.PIPE,
+            encoding="utf-8",
+            timeout=_LS_REMOTE_TIMEOUT,
+            check=True,
+        ).stdout
+    except (OSError, _subprocess.SubprocessError):
+        return None
+
+    refs = {}
+    for line in output.splitlines():
+        commit, _, ref = line.partition("\t")
+        refs.setdefault(ref, commit)
+    # Annotated tags point to a tag object, the commit is the "peeled" ref
+    for ref, commit in refs.items():
+        if ref.endswith("^{}"):
+            return commit
+    return next(iter(refs.values()), None)
+
+
+def get_commit(repository):
+    """Return the commit checked out in a repository, or None if it is not one."""
+    if not (repository / ".git").exists():
+        return None
+    try:
+        return _subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=_subprocess.PIPE,
+            encoding="utf-8",
+            cwd=repository,
+        ).strip()
+    except (OSError, _subprocess.CalledProcessError):
+        return None
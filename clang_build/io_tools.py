@@ -1,46 +1,72 @@
 from glob import iglob as _iglob
 from pathlib import Path as _Path
 
+from .stat_cache import StatCache as _StatCache
 
-def _get_header_files_in_folders(folders, exclude_patterns=[], recursive=True):
+
+def _get_header_files_in_folders(
+    folders, exclude_patterns=[], recursive=True, stat_cache=None, searched=None
+):
     delimiter = "/**/" if recursive else "/*"
     patterns = [
         str(folder) + delimiter + ext
         for ext in ("*.hpp", "*.hxx", "*.h")
         for folder in folders
     ]
-    return _get_files_in_patterns(patterns)
+    return _get_files_in_patterns(patterns, stat_cache=stat_cache, searched=searched)
 
 
-def _get_source_files_in_folders(folders, exclude_patterns=[], recursive=True):
+def _get_source_files_in_folders(
+    folders, exclude_patterns=[], recursive=True, stat_cache=None, searched=None
+):
     delimiter = "/**/" if recursive else "/*"
     patterns = [
         str(folder) + delimiter + ext
         for ext in ("*.cpp", "*.cxx", "*.c")
         for folder in folders
     ]
-    return _get_files_in_patterns(patterns)
+    return _get_files_in_patterns(patterns, stat_cache=stat_cache, searched=searched)
 
 
-def _get_files_in_patterns(patterns, exclude_patterns=[], recursive=True):
-    included = [
-        _Path(f)
-        for pattern in patterns
-        for f in _iglob(str(pattern), recursive=recursive)
-        if _Path(f).is_file()
-    ]
-    excluded = [
-        _Path(f)
-        for pattern in exclude_patterns
-        for f in _iglob(str(pattern), recursive=recursive)
-        if _Path(f).is_file()
-    ]
-    return list(f.resolve() for f in (set(included) - set(excluded)))
+def _get_files_in_patterns(
+    patterns, exclude_patterns=[], recursive=True, stat_cache=None, searched=None
+):
+    if stat_cache is None:
+        stat_cache = _StatCache()
+    if searched is not None:
+        searched += [str(pattern) for pattern in [*patterns, *exclude_patterns]]
+
+    def files_in_patterns(patterns):
+        paths = [
+            path
+            for pattern in patterns
+            for path in _iglob(str(pattern), recursive=recursive)
+        ]
+        stat_cache.prefetch(paths)
+        return set(_Path(path) for path in paths if stat_cache.is_file(path))
+
+    included = files_in_patterns(patterns)
+    excluded = files_in_patterns(exclude_patterns)
+    return sorted(f.resolve() for f in (included - excluded))
 
 
 def get_sources_and_headers(
-    target_name, platform, target_options, target_root_directory, target_build_directory
+    target_name,
+    platform,
+    target_options,
+    target_root_directory,
+    target_build_directory,
+    stat_cache=None,
+    searched=None,
 ):
+    """Return the headers, include directories and sources of a target.
+
+    If a list ``searched`` is given, all glob patterns which were searched
+    for files are appended to it.
+    """
+    if stat_cache is None:
+        stat_cache = _StatCache()
+
     output = {
         "headers": [],
         "include_directories": [],
@@ -76,6 +102,8 @@ def get_sources_and_headers(
             output["include_directories"],
             exclude_patterns=exclude_patterns,
             recursive=True,
+            stat_cache=stat_cache,
+            searched=searched,
         )
     else:
         output["include_directories"] += [
@@ -87,6 +115,8 @@ def get_sources_and_headers(
             output["include_directories"],
             exclude_patterns=exclude_patterns,
             recursive=False,
+            stat_cache=stat_cache,
+            searched=searched,
         )
 
     # Options for public include directories, exclude patterns are the same
@@ -113,6 +143,8 @@ def get_sources_and_headers(
             output["public_include_directories"],
             exclude_patterns=exclude_patterns,
             recursive=True,
+            stat_cache=stat_cache,
+            searched=searched,
         )
     else:
         output["public_include_directories"] += [
@@ -124,16 +156,20 @@ def get_sources_and_headers(
             output["public_include_directories"],
             exclude_patterns=exclude_patterns,
             recursive=False,
+            stat_cache=stat_cache,
+            searched=searched,
         )
 
     # Keep only include directories which exist
     output["include_directories"] = [
-        directory for directory in output["include_directories"] if directory.exists()
+        directory
+        for directory in output["include_directories"]
+        if stat_cache.exists(directory)
     ]
     output["public_include_directories"] = [
         directory
         for directory in output["public_include_directories"]
-        if directory.exists()
+        if stat_cache.exists(directory)
     ]
 
     # Options for sources
@@ -157,7 +193,11 @@ def get_sources_and_headers(
     # Find source files from patterns (recursively)
     if sources_patterns:
         output["sourcefiles"] += _get_files_in_patterns(
-            sources_patterns, exclude_patterns=exclude_patterns, recursive=True
+            sources_patterns,
+            exclude_patterns=exclude_patterns,
+            recursive=True,
+            stat_cache=stat_cache,
+            searched=searched,
         )
     # Else search source files in folder with same name as target and src folder (recursively)
     else:
@@ -168,12 +208,18 @@ def get_sources_and_headers(
             ],
             exclude_patterns=exclude_patterns,
             recursive=True,
+            stat_cache=stat_cache,
+            searched=searched,
         )
 
     # Search the root folder as last resort (non-recursively)
     if not output["sourcefiles"]:
         output["sourcefiles"] += _get_source_files_in_folders(
-            [target_root_directory], exclude_patterns=exclude_patterns, recursive=False
+            [target_root_directory],
+            exclude_patterns=exclude_patterns,
+            recursive=False,
+            stat_cache=stat_cache,
+            searched=searched,
         )
 
     # Fill return dict
@@ -0,0 +1,100 @@
+"""Module for the PathPrefixMap class."""
+
+import os as _os
+import re as _re
+
+# Characters which end the name of a directory within a path or a command
+_END_OF_NAME = r"""(?=[/\\\s"':=,;)]|$)"""
+
+# Characters before the start of a path in a text
+_START_OF_PATH = r"""(?<![^\s"'(])"""
+
+
+class PathPrefixMap:
+    """Maps absolute directories to relative paths and back.
+
+    In relocatable builds, the directories of the project are replaced by
+    paths relative to the project root in everything which should not
+    depend on where the project is: hashes of commands, keys and content of
+    the compile cache, and (through ``-ffile-prefix-map``) the paths in the
+    object files themselves.
+
+    An empty map, which is false, leaves everything as it is.
+    """
+
+    def __init__(self, prefixes=()):
+        """Create the map from pairs of an absolute directory and the relative path it is mapped to."""
+        # The most specific prefix is tried first
+        self._prefixes = sorted(
+            ((str(prefix), str(name)) for prefix, name in prefixes),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._relocate_pattern = None
+        self._restore_pattern = None
+        if self._prefixes:
+            self._relocate_pattern = _re.compile(
+                "(?:"
+                + "|".join(_re.escape(prefix) for prefix, _ in self._prefixes)
+                + ")"
+                + _END_OF_NAME
+            )
+            names = sorted((name for _, name in self._prefixes), key=len, reverse=True)
+            self._restore_pattern = _re.compile(
+                _START_OF_PATH
+                + "(?:"
+                + "|".join(_re.escape(name) for name in names)
+                + r")(?=[/\\])"
+            )
+        self._by_prefix = dict(self._prefixes)
+        self._by_name = {name: prefix for prefix, name in self._prefixes}
+
+    @classmethod
+    def for_project(cls, project_root, working_directory=None):
+        """Return the map of the project root and the working directory to paths relative to the root.
+
+        The working directory contains the build directory and is the
+        directory in which the compiler runs.
+        """
+        project_root = _os.path.realpath(project_root)
+        working_directory = _os.path.realpath(working_directory or _os.getcwd())
+        prefixes = [(project_root, ".")]
+        if working_directory != project_root:
+            try:
+                prefixes.append(
+                    (
+                        working_directory,
+                        _os.path.relpath(working_directory, project_root),
+                    )
+                )
+            except ValueError:
+                # On Windows, there is no relative path between drives
+                pass
+        return cls(prefixes)
+
+    def __bool__(self):
+        return bool(self._prefixes)
+
+    def __iter__(self):
+        """Iterate over the pairs of directory and relative path, the most specific directory first."""
+        return iter(self._prefixes)
+
+    def relocate(self, text):
+        """Replace the mapped directories in a path, argument or text by their relative paths."""
+        if self._relocate_pattern is None:
+            return text
+        return self._relocate_pattern.sub(
+            lambda match: self._by_prefix[match.group(0)], text
+        )
+
+    def restore(self, text):
+        """Replace relative paths at the start of the paths in a text by their directories.
+
+        This reverses :any:`relocate` for paths which were in a mapped
+        directory. Absolute paths are left as they are.
+        """
+        if self._restore_pattern is None:
+            return text
+        return self._restore_pattern.sub(
+            lambda match: self._by_name[match.group(0)], text
+        )
@@ -0,0 +1,95 @@
+"""Module for the ProbeCache class."""
+
+import json as _json
+import logging as _logging
+import os as _os
+import threading as _threading
+
+_LOGGER = _logging.getLogger(__name__)
+
+_PROBE_CACHE_VERSION = 1
+
+
+class ProbeCache:
+    """Results of probing compilers, e.g. for supported dialects, kept across runs.
+
+    Probing a compiler spawns it, which takes long compared to a build with
+    nothing to do. Results are kept per compiler executable, together with
+    its size and modification time, in the build directory. A compiler is
+    probed again only when it changed, e.g. by an update.
+    """
+
+    def __init__(self, path):
+        """Use the cache file ``path``."""
+        self._path = path
+        self._compilers = None
+        self._lock = _threading.Lock()
+
+    def _load(self):
+        if self._compilers is not None:
+            return
+        self._compilers = {}
+        try:
+            content = _json.loads(self._path.read_text())
+            if content.get("version") == _PROBE_CACHE_VERSION:
+                self._compilers = dict(content["compilers"])
+        except (OSError, ValueError, AttributeError, KeyError, TypeError):
+            pass
+
+    def _save(self):
+        """Write the cache file, which is never seen partially written by other runs."""
+        temporary_path = self._path.with_name(f"{self._path.name}.{_os.getpid()}.tmp")
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path.write_text(
+                _json.dumps(
+                    {"version": _PROBE_CACHE_VERSION, "compilers": self._compilers},
+                    indent=2,
+                    sort_keys=True,
+                )
+            )
+            _os.replace(temporary_path, self._path)
+        except OSError as error:
+            _LOGGER.debug(f'Could not write the probe cache "{self._path}": {error}')
+
+    def probe(self, compiler, name, function):
+        """Return the result of probing a compiler, which is cached under ``name``.
+
+        Parameters
+        ----------
+        compiler : pathlib.Path
+            The executable, which is probed
+        name : str
+            Identifies the probe among all probes of the compiler
+        function : callable
+            Probes the compiler and returns a result, which can be stored as
+            JSON. It is only called, if the compiler was not probed before
+            or changed since.
+
+        """
+        try:
+            compiler_stat = _os.stat(compiler)
+        except OSError:
+            return function()
+        signature = [compiler_stat.st_size, compiler_stat.st_mtime_ns]
+        path = str(compiler)
+
+        with self._lock:
+            self._load()
+            entry = self._compilers.get(path)
+            if entry is not None and entry["signature"] == signature:
+                if name in entry["probes"]:
+                    return entry["probes"][name]
+
+        result = function()
+
+        with self._lock:
+            # Another run may have probed other compilers in the meantime
+            self._compilers = None
+            self._load()
+            entry = self._compilers.get(path)
+            if entry is None or entry["signature"] != signature:
+                entry = self._compilers[path] = {"signature": signature, "probes": {}}
+            entry["probes"][name] = result
+            self._save()
+        return result
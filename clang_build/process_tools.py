@@ -0,0 +1,232 @@
+"""Tools to run subprocesses and to query the memory they may use."""
+
+import asyncio as _asyncio
+import contextvars as _contextvars
+import logging as _logging
+import os as _os
+import subprocess as _subprocess
+from pathlib import Path as _Path
+from sys import platform as _platform
+
+_LOGGER = _logging.getLogger(__name__)
+
+# Peak memory of the processes run in the current context (i.e. asyncio task
+# or thread), see `reset_peak_memory`. The value is a mutable list, so that
+# processes run in a copy of the context, e.g. by `asyncio.to_thread`, are
+# accounted for as well.
+_PEAK_MEMORY = _contextvars.ContextVar("peak_memory", default=None)
+
+# Size of the chunks in which the output of a process is read
+_READ_CHUNK_SIZE = 64 * 1024
+
+
+def reset_peak_memory():
+    """Reset the peak memory recorded for processes run in the current context.
+
+    The context is that of the current asyncio task or thread.
+    """
+    _PEAK_MEMORY.set([None])
+
+
+def get_peak_memory():
+    """Return the largest peak resident set size (in bytes) of the processes run
+    in the current context since the last call to `reset_peak_memory`.
+
+    Returns None if no process was run or its usage could not be measured.
+    """
+    peak_memory = _PEAK_MEMORY.get()
+    return None if peak_memory is None else peak_memory[0]
+
+
+def _record_peak_memory(rusage):
+    # Linux reports the maximum resident set size in kilobytes, macOS in bytes
+    peak_memory = rusage.ru_maxrss if _platform == "darwin" else rusage.ru_maxrss * 1024
+    recorded = _PEAK_MEMORY.get()
+    if recorded is None:
+        recorded = [None]
+        _PEAK_MEMORY.set(recorded)
+    if recorded[0] is None or peak_memory > recorded[0]:
+        recorded[0] = peak_memory
+
+
+def run_command(command):
+    """Run a command and return whether it succeeded together with its output.
+
+    Standard output and error are combined. Where available, the process is
+    reaped with `os.wait4` to record its peak memory usage for the current
+    context. This blocks the calling thread, see `run_command_async` for a
+    coroutine.
+
+    Returns
+    -------
+    bool
+        True if the command returned 0, False otherwise
+    str
+        The output of the command
+
+    """
+    if not hasattr(_os, "wait4"):
+        try:
+            return True, _subprocess.check_output(
+                command, encoding="utf8", stderr=_subprocess.STDOUT
+            )
+        except _subprocess.CalledProcessError as error:
+            return False, error.output.strip()
+
+    with _subprocess.Popen(
+        command, stdout=_subprocess.PIPE, stderr=_subprocess.STDOUT, encoding="utf8"
+    ) as process:
+        output = process.stdout.read()
+        _, status, rusage = _os.wait4(process.pid, 0)
+        process.returncode = _os.waitstatus_to_exitcode(status)
+
+    _record_peak_memory(rusage)
+
+    if process.returncode != 0:
+        return False, output.strip()
+    return True, output
+
+
+async def run_command_async(command):
+    """Run a command without blocking and return whether it succeeded together
+    with its output.
+
+    Standard output and error are combined and read from the event loop while
+    the process runs. On Linux, the exit of the process is awaited through a
+    pidfd and it is reaped with `os.wait4` to record its peak memory usage for
+    the current context. Otherwise `asyncio.create_subprocess_exec` is used,
+    which does not report the memory usage.
+
+    Returns
+    -------
+    bool
+        True if the command returned 0, False otherwise
+    str
+        The output of the command
+
+    """
+    if hasattr(_os, "pidfd_open") and hasattr(_os, "wait4"):
+        returncode, output = await _run_and_wait4(command)
+    else:
+        process = await _asyncio.create_subprocess_exec(
+            *command, stdout=_subprocess.PIPE, stderr=_subprocess.STDOUT
+        )
+        try:
+            output = await _read_stream(process.stdout)
+            returncode = await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+    if returncode != 0:
+        return False, output.strip()
+    return True, output
+
+
+async def _read_stream(stream):
+    """Read an asyncio stream until its end and decode it."""
+    chunks = []
+    while True:
+        chunk = await stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks).decode("utf8", errors="replace")
+
+
+async def _run_and_wait4(command):
+    """Run a command with the event loop and reap it with `os.wait4`.
+
+    The child watcher of `asyncio.create_subprocess_exec` reaps processes
+    itself, discarding their resource usage, so the process is started
+    directly and its output pipe and pidfd are registered with the loop.
+    """
+    loop = _asyncio.get_running_loop()
+    process = _subprocess.Popen(
+        command, stdout=_subprocess.PIPE, stderr=_subprocess.STDOUT
+    )
+    pidfd = _os.pidfd_open(process.pid)
+    try:
+        stream = _asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: _asyncio.StreamReaderProtocol(stream), process.stdout
+        )
+        try:
+            output = await _read_stream(stream)
+        finally:
+            transport.close()
+
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        _, status, rusage = _os.wait4(process.pid, 0)
+        process.returncode = _os.waitstatus_to_exitcode(status)
+        _os.close(pidfd)
+
+    _record_peak_memory(rusage)
+    return process.returncode, output
+
+
+def _read_int(path):
+    try:
+        return int(_Path(path).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _cgroup_available_memory():
+    """Return the memory left below the limit of the own cgroup, if there is one."""
+    # cgroup v2: the own cgroup is given by the "0::<path>" line
+    try:
+        for line in _Path("/proc/self/cgroup").read_text().splitlines():
+            if line.startswith("0::"):
+                cgroup = _Path("/sys/fs/cgroup") / line[3:].lstrip("/")
+                limit = _read_int(cgroup / "memory.max")
+                usage = _read_int(cgroup / "memory.current")
+                if limit is not None and usage is not None:
+                    return max(0, limit - usage)
+    except OSError:
+        pass
+
+    # cgroup v1, where "no limit" is a very large number
+    limit = _read_int("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    usage = _read_int("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    if limit is not None and usage is not None and limit < 2**60:
+        return max(0, limit - usage)
+
+    return None
+
+
+def _system_available_memory():
+    """Return the "MemAvailable" of /proc/meminfo, if there is one."""
+    try:
+        for line in _Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def available_memory():
+    """Return the number of bytes of memory available for new processes.
+
+    Both the limit of the cgroup this process runs in (e.g. inside a
+    container) and the memory available on the system are taken into account.
+    Returns None if neither can be determined.
+    """
+    available = [
+        memory
+        for memory in (_cgroup_available_memory(), _system_available_memory())
+        if memory is not None
+    ]
+    return min(available) if available else None
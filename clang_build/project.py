@@ -1,18 +1,20 @@
 """A class that contains potentially multiple targets and other projects."""
 
+import asyncio as _asyncio
+import json as _json
 import logging as _logging
 import textwrap as _textwrap
-from multiprocessing import Pool as _Pool
+import time as _time
 from pathlib import Path as _Path
 from typing import Optional as _Optional
 from importlib import util as importlib_util
 
 import networkx as _nx
-import toml
 
 from .circle import Circle as _Circle
-from .io_tools import get_sources_and_headers as _get_sources_and_headers
 from .logging_tools import NamedLogger as _NamedLogger
+from .scheduler import LinkJob as _LinkJob
+from .scheduler import Scheduler as _Scheduler
 from .target import TARGET_MAP as _TARGET_MAP
 from .target import Target as _Target
 from .target import Executable as _Executable
@@ -273,7 +275,7 @@ class Project(_NamedLogger, _TreeEntry):
 
         elif toml_file.exists():
             logger.info(f"Found config file '{toml_file}'.")
-            config = toml.load(toml_file)
+            config = environment.configuration_cache.load_toml(toml_file)
 
         elif parent:
             error_message = parent.log_message(
@@ -446,6 +448,7 @@ class Project(_NamedLogger, _TreeEntry):
         build_all: bool = False,
         target_list: _Optional[list] = None,
         number_of_threads: _Optional[int] = None,
+        number_of_link_jobs: _Optional[int] = None,
     ):
         """Build targets of this project.
 
@@ -453,6 +456,9 @@ class Project(_NamedLogger, _TreeEntry):
         as all their dependencies. This function will configure all targets
         that haven't been configured in a previous call.
 
+        This runs :any:`build_async` in a new event loop, so it cannot be
+        called from a running event loop.
+
         Parameters
         ----------
         build_all : bool
@@ -462,9 +468,110 @@ class Project(_NamedLogger, _TreeEntry):
             If given, will build all targets in this project that are in the
             given list, as well as all their dependencies.
         number_of_threads : int
-            If given will compile targets with the given number of threads. Otherwise
-            it will use the default number of CPU cores visible to Python.
+            If given, at most this many compile and link jobs will run concurrently.
+            Otherwise the number of CPUs usable by this process is used.
+        number_of_link_jobs : int
+            If given, at most this many link jobs will run concurrently.
+            Otherwise a quarter of ``number_of_threads``, but at least 2, is used.
+
+        """
+        _asyncio.run(
+            self.build_async(
+                build_all, target_list, number_of_threads, number_of_link_jobs
+            )
+        )
+
+    async def build_async(
+        self,
+        build_all: bool = False,
+        target_list: _Optional[list] = None,
+        number_of_threads: _Optional[int] = None,
+        number_of_link_jobs: _Optional[int] = None,
+    ):
+        """Coroutine which builds targets of this project, see :any:`build`.
 
+        Compilers and linkers are run as subprocesses of the running event
+        loop. Configuration (including the download of external sources)
+        and bundling are run in a separate thread, so that the event loop is
+        not blocked by them.
+        """
+        build_start = _time.time_ns()
+
+        # Files may have changed since a previous build with this environment.
+        # The files known from previous builds are stat'ed all at once.
+        self._environment.stat_cache.clear()
+        await _asyncio.to_thread(self._environment.build_state.prefetch)
+        await _asyncio.to_thread(self._environment.target_state.prefetch)
+
+        target_build_list = await _asyncio.to_thread(
+            self._configure_targets_to_build, build_all, target_list
+        )
+
+        # Compile and link all targets as a single graph of jobs. Link jobs
+        # only wait for the objects and libraries they actually consume, so
+        # that they can run while unrelated targets are still compiling.
+        scheduler = _Scheduler(
+            number_of_threads, self._environment.build_log, number_of_link_jobs
+        )
+        compile_jobs = {}
+        for target in target_build_list:
+            compile_jobs[target] = target.compile_jobs()
+            for job in compile_jobs[target]:
+                scheduler.add_job(job)
+
+        link_jobs = {}
+        for target in target_build_list:
+            link_jobs[target] = _LinkJob(target)
+            scheduler.add_job(
+                link_jobs[target],
+                target.link_job_dependencies(compile_jobs, link_jobs),
+            )
+
+        try:
+            await scheduler.run()
+            for target in target_build_list:
+                await _asyncio.to_thread(target.record_state, build_start)
+        finally:
+            self._environment.build_log.save()
+            self._environment.build_state.save()
+            self._environment.target_state.save()
+            self._environment.configuration_cache.save()
+            if self._environment.compile_cache is not None:
+                await _asyncio.to_thread(
+                    self._environment.compile_cache.save,
+                    self._environment.build_directory / ".clang_build_cache_entries",
+                )
+
+            # Update database with compile commands
+            self._environment.compilation_database_file.parent.mkdir(
+                parents=True, exist_ok=True
+            )
+            self._environment.compilation_database_file.write_text(
+                _json.dumps(
+                    self._environment.compilation_database, indent=2, sort_keys=True
+                )
+            )
+
+        await _asyncio.to_thread(self._bundle_targets, target_build_list)
+
+    def configure(self, build_all: bool = False, target_list: _Optional[list] = None):
+        """Configure the targets of this project, which :any:`build` would build, without building them.
+
+        Returns
+        -------
+        list
+            The configured targets in build order
+
+        """
+        self._environment.stat_cache.clear()
+        return self._configure_targets_to_build(build_all, target_list)
+
+    def _configure_targets_to_build(
+        self, build_all: bool = False, target_list: _Optional[list] = None
+    ):
+        """Configure the targets to build and return them in build order.
+
+        The sources of their projects are retrieved, if necessary.
         """
         # Get targets to build
         targets_to_build = self._get_targets_to_build(build_all, target_list)
@@ -514,26 +621,19 @@ class Project(_NamedLogger, _TreeEntry):
                 f"Building {', '.join([str(target) for target in target_build_list])}"
             )
 
-        # Compile
-        with _Pool(processes=number_of_threads) as process_pool:
-            for target in target_build_list:
-                target.compile(process_pool, False)
-
-        # Link
-        for target in target_build_list:
-            target.link()
+        return target_build_list
 
+    def _bundle_targets(self, target_build_list):
+        """Create the bundles of the built targets, if requested."""
         # Bundle
         if self._environment.bundle:
-            with _Pool(processes=number_of_threads) as process_pool:
-                for target in target_build_list:
-                    target.bundle()
+            for target in target_build_list:
+                target.bundle()
 
         # Redistributable bundle
         if self._environment.redistributable:
-            with _Pool(processes=number_of_threads) as process_pool:
-                for target in target_build_list:
-                    target.redistributable()
+            for target in target_build_list:
+                target.redistributable()
 
     def _get_targets_to_build(
         self, build_all: bool = False, target_list: _Optional[list] = None
@@ -731,7 +831,7 @@ class Project(_NamedLogger, _TreeEntry):
 
         # Sources
         target_description.get_sources()
-        files = _get_sources_and_headers(
+        files = self._environment.configuration_cache.get_sources_and_headers(
             target_description.name,
             self._environment.toolchain.platform,
             target_description.config,
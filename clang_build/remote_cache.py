@@ -0,0 +1,143 @@
+"""Module for the RemoteCache class, the client of a shared HTTP cache."""
+
+import hashlib as _hashlib
+import json as _json
+import logging as _logging
+import threading as _threading
+import urllib.error as _urllib_error
+import urllib.request as _urllib_request
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+from concurrent.futures import wait as _wait
+
+_LOGGER = _logging.getLogger(__name__)
+
+# Seconds to wait for the server, before it is considered unavailable
+_TIMEOUT = 10
+
+# Number of uploads running at the same time
+_UPLOAD_THREADS = 4
+
+
+def sha256(content):
+    """Return the hex digest of the SHA-256 hash of bytes, as used for keys of the cache."""
+    return _hashlib.sha256(content).hexdigest()
+
+
+class RemoteCache:
+    """Client of a cache server with the HTTP layout of `bazel-remote`.
+
+    The server stores blobs under ``/cas/<sha256>``, where the key is the
+    hash of the content ("content addressable storage"), and arbitrary
+    entries under ``/ac/<sha256>`` ("action cache"). Blobs and entries are
+    read with GET and written with PUT. A missing key is answered with 404.
+
+    Entries are JSON documents here, which refer to blobs by their hash.
+    Downloaded blobs are checked against their hash. By default, a
+    bazel-remote server only accepts ActionResult protobufs as entries, so
+    it has to be run with ``--disable_http_ac_validation``.
+
+    Uploads run in background threads, see :any:`upload` and :any:`wait`.
+    Failed uploads are reported once by :any:`wait`.
+    If the server cannot be reached, it is not asked again, so that a build
+    without network access does not wait for every request to time out.
+    """
+
+    def __init__(self, url, read_only=False):
+        self.url = url.rstrip("/")
+        self.read_only = read_only
+        self._available = True
+        self._lock = _threading.Lock()
+        self._uploads = []
+        self._executor = None
+        self._failed_uploads = 0
+        self._upload_error = None
+
+    def _request(self, method, path, content=None):
+        """Send a request and return the content of the response, or None on failure."""
+        if not self._available:
+            return None
+        request = _urllib_request.Request(
+            f"{self.url}/{path}", data=content, method=method
+        )
+        if content is not None:
+            request.add_header("Content-Type", "application/octet-stream")
+        try:
+            with _urllib_request.urlopen(request, timeout=_TIMEOUT) as response:
+                return response.read()
+        except _urllib_error.HTTPError as error:
+            if error.code != 404:
+                _LOGGER.debug(f'{method} "{path}" failed: {error}')
+            if method == "PUT":
+                self._upload_failed(error)
+            return None
+        except (_urllib_error.URLError, OSError) as error:
+            with self._lock:
+                if self._available:
+                    _LOGGER.warning(
+                        f'The remote cache "{self.url}" is not available: {error}'
+                    )
+                    self._available = False
+            return None
+
+    def _upload_failed(self, error):
+        with self._lock:
+            self._failed_uploads += 1
+            self._upload_error = error
+
+    def get_blob(self, digest):
+        """Return the blob with the given hash, or None if it is not in the cache."""
+        content = self._request("GET", f"cas/{digest}")
+        if content is None or sha256(content) != digest:
+            return None
+        return content
+
+    def put_blob(self, content):
+        """Upload a blob and return its hash."""
+        digest = sha256(content)
+        self._request("PUT", f"cas/{digest}", content)
+        return digest
+
+    def get_entry(self, key):
+        """Return the entry with the given key, or None if it is not in the cache."""
+        content = self._request("GET", f"ac/{key}")
+        if content is None:
+            return None
+        try:
+            return _json.loads(content)
+        except ValueError:
+            return None
+
+    def put_entry(self, key, entry):
+        """Upload an entry, which has to be serializable to JSON."""
+        self._request("PUT", f"ac/{key}", _json.dumps(entry).encode())
+
+    def upload(self, function, *args):
+        """Call ``function(*args)`` in a background thread, unless the cache is read-only."""
+        if self.read_only or not self._available:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = _ThreadPoolExecutor(
+                    max_workers=_UPLOAD_THREADS, thread_name_prefix="upload"
+                )
+            self._uploads.append(self._executor.submit(function, *args))
+
+    def wait(self):
+        """Wait for all uploads to finish."""
+        with self._lock:
+            uploads, self._uploads = self._uploads, []
+        if uploads:
+            _LOGGER.info(f"Waiting for {len(uploads)} upload(s) to the remote cache")
+        for upload in _wait(uploads).done:
+            if upload.exception() is not None:
+                self._upload_failed(upload.exception())
+
+        with self._lock:
+            failed_uploads, self._failed_uploads = self._failed_uploads, 0
+            error, self._upload_error = self._upload_error, None
+        if failed_uploads:
+            _LOGGER.warning(
+                f'{failed_uploads} upload(s) to the remote cache "{self.url}"'
+                f" failed, the last one with: {error}. A bazel-remote server has"
+                " to be run with --disable_http_ac_validation."
+            )
@@ -0,0 +1,354 @@
+"""Module containing the build graph of compile and link jobs and its scheduler.
+
+Instead of building one target after the other, all jobs of all targets are
+collected into a single graph. Any job whose inputs are ready is started,
+independent of which target it belongs to.
+"""
+
+import asyncio as _asyncio
+import heapq as _heapq
+import logging as _logging
+import os as _os
+import time as _time
+
+import networkx as _nx
+
+from .errors import CompileError as _CompileError
+from .errors import LinkError as _LinkError
+from .process_tools import available_memory as _available_memory
+from .process_tools import get_peak_memory as _get_peak_memory
+from .process_tools import reset_peak_memory as _reset_peak_memory
+
+_LOGGER = _logging.getLogger(__name__)
+
+# Rough compile throughput, used to estimate the duration of compile jobs
+# which have not been run before from the size of their source file
+_ESTIMATED_BYTES_COMPILED_PER_SECOND = 20000
+
+# Rough duration of linking, used for link jobs which have not been run before
+_ESTIMATED_LINK_SECONDS = 0.5
+_ESTIMATED_LINK_SECONDS_PER_OBJECT = 0.01
+
+# Rough peak memory of jobs, for which none was recorded in previous builds
+_ESTIMATED_COMPILE_MEMORY = 512 * 1024**2
+_ESTIMATED_LINK_MEMORY = 1024**3
+
+
+def usable_cpu_count():
+    """Return the number of CPUs this process is allowed to run on."""
+    try:
+        return len(_os.sched_getaffinity(0))
+    except AttributeError:
+        return _os.cpu_count() or 1
+
+
+class Job:
+    """Base class for a single unit of work in the build graph.
+
+    A job belongs to a target and is run at most once. If it fails, the
+    report of the failure is stored in ``report``. Whether it actually ran a
+    compiler or linker process, rather than finding its output up to date or
+    in a cache, is stored in ``ran_process``.
+
+    Jobs with a ``pool`` name share a separate, usually smaller, limit on how
+    many of them may run at the same time.
+    """
+
+    pool = None
+
+    def __init__(self, target):
+        self.target = target
+        self.failed = False
+        self.report = None
+        self.ran_process = False
+
+    @property
+    def output(self):
+        """Return the file produced by this job, which identifies it across builds."""
+        return None
+
+    def estimated_duration(self):
+        """Return a guess of the duration in seconds, if the job was never run before."""
+        return 0.0
+
+    def estimated_peak_memory(self):
+        """Return a guess of the peak memory in bytes, if the job was never run before."""
+        return 0
+
+    async def run(self):
+        """Coroutine which runs the job. Sets ``failed`` and ``report`` if unsuccessful."""
+
+
+class CompileJob(Job):
+    """Compiles a single source file of a target into an object file."""
+
+    def __init__(self, target, buildable):
+        super().__init__(target)
+        self.buildable = buildable
+
+    def __str__(self) -> str:
+        return f"{self.target}: compile {self.buildable.name}"
+
+    @property
+    def output(self):
+        return self.buildable.object_file
+
+    def estimated_duration(self):
+        try:
+            source_size = self.buildable.source_file.stat().st_size
+        except OSError:
+            source_size = 0
+        return source_size / _ESTIMATED_BYTES_COMPILED_PER_SECOND
+
+    def estimated_peak_memory(self):
+        return _ESTIMATED_COMPILE_MEMORY
+
+    async def run(self):
+        self.ran_process = await self.buildable.compile()
+        self.failed = self.buildable.compilation_failed
+        self.report = self.buildable.compile_report
+
+
+class LinkJob(Job):
+    """Links (or archives) the object files of a target."""
+
+    pool = "link"
+
+    def __str__(self) -> str:
+        return f"{self.target}: link"
+
+    @property
+    def output(self):
+        return getattr(self.target, "outfile", None)
+
+    def _links(self):
+        """Return whether the target has objects to link, which up-to-date targets do not."""
+        return not getattr(self.target, "up_to_date", False) and hasattr(
+            self.target, "buildables"
+        )
+
+    def estimated_duration(self):
+        if not self._links():
+            return 0.0
+        return (
+            _ESTIMATED_LINK_SECONDS
+            + len(self.target.buildables) * _ESTIMATED_LINK_SECONDS_PER_OBJECT
+        )
+
+    def estimated_peak_memory(self):
+        if not self._links():
+            return 0
+        return _ESTIMATED_LINK_MEMORY
+
+    async def run(self):
+        try:
+            self.ran_process = bool(await self.target.link())
+        except _LinkError as link_error:
+            self.failed = True
+            self.report = link_error.error_dict[self.target.identifier]
+
+
+class Scheduler:
+    """Runs a graph of jobs, starting every job as soon as its dependencies are done.
+
+    The graph is a :any:`networkx.DiGraph`, where an edge ``(a, b)`` means that
+    job ``a`` has to be finished before job ``b`` can be started.
+    At most ``number_of_jobs`` jobs run at the same time, each as a task of
+    one event loop. As every job runs one compiler or linker process at a
+    time, this also limits the number of concurrent subprocesses.
+    After the first failure no new jobs are started, but the running ones are
+    allowed to finish.
+
+    Of the jobs which are ready, the one with the longest remaining path to
+    the end of the build (the critical path) is started first. The duration
+    of each job is taken from the ``build_log`` of previous builds, if it was
+    recorded there, and is otherwise estimated. The durations of this build
+    are recorded to the ``build_log``, if they ran a compiler or linker.
+
+    Jobs are only admitted while the sum of the peak memory of all running
+    jobs, as recorded in the ``build_log`` (or estimated), fits into the
+    memory which was available when the build started. If no job is running,
+    the next one is always started. In addition, at most
+    ``number_of_link_jobs`` link jobs run at the same time, because linking
+    usually needs a lot more memory than compiling.
+    """
+
+    def __init__(self, number_of_jobs=None, build_log=None, number_of_link_jobs=None):
+        self._graph = _nx.DiGraph()
+        self._number_of_jobs = max(1, number_of_jobs or usable_cpu_count())
+        self._build_log = build_log
+        if number_of_link_jobs is None:
+            number_of_link_jobs = max(2, self._number_of_jobs // 4)
+        self._pool_limits = {
+            LinkJob.pool: max(1, min(number_of_link_jobs, self._number_of_jobs))
+        }
+
+    @property
+    def graph(self):
+        """Return the :any:`networkx.DiGraph` of jobs."""
+        return self._graph
+
+    def add_job(self, job, dependencies=None):
+        """Add a job, which may only start after all of its ``dependencies`` are done."""
+        self._graph.add_node(job)
+        for dependency in dependencies or []:
+            self._graph.add_edge(dependency, job)
+
+    async def run(self):
+        """Coroutine which runs all jobs of the graph.
+
+        Raises
+        ------
+        CompileError
+            If any compile job failed.
+        LinkError
+            If any link job failed.
+
+        """
+        _LOGGER.debug(
+            "Running build graph with %d job(s), of which %d may be link jobs",
+            self._number_of_jobs,
+            self._pool_limits[LinkJob.pool],
+        )
+        failed_jobs = await self._run_jobs()
+
+        compile_errors = {}
+        link_errors = {}
+        for job in failed_jobs:
+            if isinstance(job, CompileJob):
+                compile_errors.setdefault(job.target.identifier, []).append(job.report)
+            else:
+                link_errors[job.target.identifier] = job.report
+
+        if compile_errors:
+            raise _CompileError("Compilation was unsuccessful", compile_errors)
+        if link_errors:
+            raise _LinkError("Linking was unsuccessful", link_errors)
+
+    def _recorded(self, job, key):
+        """Return a value recorded for the job in the build log of previous builds."""
+        if self._build_log is None or job.output is None:
+            return None
+        return self._build_log.get(job.output, key)
+
+    def _duration(self, job):
+        """Return the recorded duration of a job or an estimate of it."""
+        duration = self._recorded(job, "duration")
+        return job.estimated_duration() if duration is None else duration
+
+    def _peak_memory(self, job):
+        """Return the recorded peak memory of a job or an estimate of it."""
+        peak_memory = self._recorded(job, "peak_memory")
+        return job.estimated_peak_memory() if peak_memory is None else peak_memory
+
+    def _critical_path_lengths(self):
+        """Return, for every job, the duration of the longest path from its start to the end of the build."""
+        lengths = {}
+        for job in reversed(list(_nx.topological_sort(self._graph))):
+            lengths[job] = self._duration(job) + max(
+                (lengths[dependent] for dependent in self._graph.successors(job)),
+                default=0.0,
+            )
+        return lengths
+
+    async def _run_jobs(self):
+        critical_path_lengths = self._critical_path_lengths()
+        remaining_dependencies = {
+            job: self._graph.in_degree(job) for job in self._graph.nodes
+        }
+
+        # Heap of ready jobs, longest critical path first. The counter keeps
+        # the order stable for jobs of equal length.
+        ready = []
+        counter = 0
+
+        def push_ready(job):
+            nonlocal counter
+            _heapq.heappush(ready, (-critical_path_lengths[job], counter, job))
+            counter += 1
+
+        for job, count in remaining_dependencies.items():
+            if count == 0:
+                push_ready(job)
+
+        running = {}
+        running_in_pool = {pool: 0 for pool in self._pool_limits}
+        failed_jobs = []
+
+        memory_budget = _available_memory()
+        reserved_memory = 0
+        if memory_budget is not None:
+            _LOGGER.debug("Memory available for jobs: %d MiB", memory_budget // 1024**2)
+
+        def admissible(job):
+            if job.pool is not None:
+                if running_in_pool[job.pool] >= self._pool_limits[job.pool]:
+                    return False
+            if memory_budget is None or not running:
+                return True
+            return reserved_memory + self._peak_memory(job) <= memory_budget
+
+        try:
+            while ready or running:
+                # Start the ready jobs in order of priority, as long as they are
+                # admissible. Jobs which have to wait are put back afterwards.
+                waiting = []
+                while ready and not failed_jobs and len(running) < self._number_of_jobs:
+                    entry = _heapq.heappop(ready)
+                    job = entry[2]
+                    if not admissible(job):
+                        waiting.append(entry)
+                        continue
+                    _LOGGER.debug("Starting job %s", job)
+                    running[_asyncio.create_task(_timed_run(job))] = job
+                    reserved_memory += self._peak_memory(job)
+                    if job.pool is not None:
+                        running_in_pool[job.pool] += 1
+                for entry in waiting:
+                    _heapq.heappush(ready, entry)
+
+                if not running:
+                    break
+
+                done, _ = await _asyncio.wait(
+                    running, return_when=_asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    job = running.pop(task)
+                    reserved_memory -= self._peak_memory(job)
+                    if job.pool is not None:
+                        running_in_pool[job.pool] -= 1
+                    duration, peak_memory = task.result()
+                    if job.failed:
+                        failed_jobs.append(job)
+                        continue
+                    # Jobs, which found their output up to date or cached, say
+                    # nothing about how long producing it takes
+                    if (
+                        job.ran_process
+                        and self._build_log is not None
+                        and job.output is not None
+                    ):
+                        self._build_log.record(job.output, duration=duration)
+                        if peak_memory is not None:
+                            self._build_log.record(job.output, peak_memory=peak_memory)
+                    for dependent in self._graph.successors(job):
+                        remaining_dependencies[dependent] -= 1
+                        if remaining_dependencies[dependent] == 0:
+                            push_ready(dependent)
+        finally:
+            # Do not leave jobs behind if the build itself is cancelled or broken
+            for task in running:
+                task.cancel()
+            if running:
+                await _asyncio.wait(running)
+
+        return failed_jobs
+
+
+async def _timed_run(job):
+    """Run a job and return its wall time in seconds and the peak memory of its processes."""
+    _reset_peak_memory()
+    start = _time.monotonic()
+    await job.run()
+    return _time.monotonic() - start, _get_peak_memory()
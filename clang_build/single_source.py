@@ -1,53 +1,14 @@
+import asyncio as _asyncio
 import os as _os
-import re as _re
+import time as _time
 from pathlib import Path as _Path
 import subprocess as _subprocess
 from multiprocessing import freeze_support as _freeze_support
 
-# import logging as _logging
-
+from .build_state import hash_command as _hash_command
+from .depfile import parse_depfile as _parse_depfile
 
-# Find and parse the dependency file, return list of headers this file depends on
-# See e.g. https://gcc.gnu.org/onlinedocs/gcc-8.1.0/gcc/Preprocessor-Options.html#Preprocessor-Options for documentation
-# TODO: Can this be simplified?
-def _get_depfile_headers(depfile):
-    depfileHeaders = []
-    with open(depfile, "r") as the_file:
-        depStr = the_file.read()
-        # Find the first colon with a space behind it, which will be right after the dependent file name
-        colonPos = depStr.find(": ")
-        # Separate the remainder into lines
-        for line in depStr[colonPos + 1 :].splitlines():
-            # Remove the newline character ('\'-newline)
-            if line.endswith("\\"):
-                line = line[:-1].strip()
-            # Add header (or source, actually)
-            depfileHeaders += list(
-                [
-                    _Path(filename).resolve()
-                    for filename in _re.split(r"(?<!\\)\s+", line)
-                ]
-            )
-    return depfileHeaders
-
-
-def _needs_rebuild(object_file, source_file, depfile):
-    if depfile.exists():
-        if object_file.exists():
-            # If object file is found, check if it is up to date
-            if source_file.stat().st_mtime > object_file.stat().st_mtime:
-                return True
-            # If object file is up to date, we check the headers it depends on
-            else:
-                for depHeaderFile in _get_depfile_headers(depfile):
-                    if depHeaderFile.stat().st_mtime > object_file.stat().st_mtime:
-                        return True
-
-                return False
-        else:
-            return True
-    else:
-        return True
+# import logging as _logging
 
 
 class SingleSource:
@@ -72,7 +33,7 @@ class SingleSource:
         # subdirectory called 'src' in the build folder structure
         relpath = _os.path.relpath(source_file.parents[0], current_target_root_path)
         if (
-            current_target_root_path.joinpath("src").exists()
+            environment.stat_cache.is_dir(current_target_root_path.joinpath("src"))
             and "src" in self.source_file.parts
         ):
             relpath = _os.path.relpath(relpath, "src")
@@ -86,59 +47,117 @@ class SingleSource:
         self.toolchain = environment.toolchain
         self.is_c_target = is_c_target
 
-        self.needs_rebuild = _needs_rebuild(
-            self.object_file, self.source_file, self.depfile
-        )
-
         self.include_directories = include_directories
         self.flags = compile_flags
 
-        self.compilation_failed = False
-
-    def generate_depfile(self):
-        command, success, self.depfile_report = self.toolchain.generate_dependency_file(
+        # Anything that changes the compile command, the compiler or its
+        # environment invalidates the object file. In relocatable builds, the
+        # location of the project does not.
+        command = self.toolchain.compile_command(
             self.source_file,
-            self.depfile,
-            self.flags,
+            self.object_file,
             self.include_directories,
+            self.flags,
             self.is_c_target,
         )
-        self.depfile_failed = not success
+        if command is None:
+            command = [
+                str(self.source_file),
+                str(self.object_file),
+                *[str(directory) for directory in self.include_directories],
+                *self.flags,
+                "c" if self.is_c_target else "c++",
+            ]
+        compiler = self.toolchain.identity()
+        self.command_hash = _hash_command(
+            command + compiler, environment.path_prefix_map
+        )
+        self._cache_key = (command, compiler)
 
-        command_missing = True
-        for idx, db_command in enumerate(self._environment.compilation_database):
-            if (
-                str(self.source_file) == db_command["file"]
-                and str(self.depfile) == db_command["output"]
-            ):
-                self._environment.compilation_database[idx] = {
-                    "directory": str(self._environment.build_directory),
-                    "command": " ".join(command),
-                    "file": str(self.source_file),
-                    "output": str(self.depfile),
-                }
-                command_missing = False
-                break
-        if command_missing:
-            self._environment.compilation_database.append(
-                {
-                    "directory": str(self._environment.build_directory),
-                    "command": " ".join(command),
-                    "file": str(self.source_file),
-                    "output": str(self.depfile),
-                }
+        # Why the object file is (not) in the compile cache, if asked for
+        if environment.explain_cache is not None and (
+            _Path(self.source_file).resolve() == environment.explain_cache
+        ):
+            environment.cache_explanations[self.source_file] = (
+                environment.compile_cache.explain(self.source_file, command, compiler)
             )
 
-    def compile(self):
-        command, success, self.compile_report = self.toolchain.compile(
-            self.source_file,
-            self.object_file,
-            self.include_directories,
-            self.flags,
-            self.is_c_target,
+        self.needs_rebuild = environment.build_state.needs_rebuild(
+            self.object_file, self.command_hash
         )
+
+        self.compilation_failed = False
+
+    async def compile(self):
+        """Coroutine which compiles the source, or takes its object file from the compile cache.
+
+        Returns
+        -------
+        bool
+            Whether the compiler was run
+
+        """
+        # Forcing a build bypasses the compile cache, but refreshes it
+        compile_cache = self._environment.compile_cache
+        cached = None
+        if compile_cache is not None and not self._environment.force_build:
+            cached = await _asyncio.to_thread(
+                compile_cache.lookup,
+                self.command_hash,
+                self.source_file,
+                self.object_file,
+                self.depfile,
+            )
+
+        if cached is not None:
+            self.compile_report = cached
+            success = True
+            command = self.toolchain.compile_command(
+                self.source_file,
+                self.object_file,
+                self.include_directories,
+                self.flags,
+                self.is_c_target,
+            )
+        else:
+            compile_start = _time.time_ns()
+            command, success, self.compile_report = await self.toolchain.compile_async(
+                self.source_file,
+                self.object_file,
+                self.include_directories,
+                self.flags,
+                self.is_c_target,
+                dependency_file=self.depfile,
+            )
         self.compilation_failed = not success
 
+        # Remember the headers found by the compiler, so that the up-to-date
+        # check of the next build does not have to read the dependency file
+        if success and self.depfile.exists():
+            dependencies = _parse_depfile(self.depfile, self._environment.stat_cache)
+            self._environment.build_state.record(
+                self.object_file,
+                [self.source_file, *dependencies],
+                self.command_hash,
+            )
+            if compile_cache is not None and cached is None:
+                await _asyncio.to_thread(
+                    compile_cache.store,
+                    self.command_hash,
+                    self.source_file,
+                    self.object_file,
+                    dependencies,
+                    self.compile_report,
+                    compile_start,
+                    *self._cache_key,
+                )
+        else:
+            self._environment.build_state.forget(self.object_file)
+
+        # Cached objects of toolchains, which do not tell their compile command
+        if command is None:
+            return cached is None
+
         command_missing = True
         for idx, db_command in enumerate(self._environment.compilation_database):
             if (
@@ -162,6 +181,7 @@ class SingleSource:
                     "output": str(self.object_file),
                 }
             )
+        return cached is None
 
 
 if __name__ == "__name__":
@@ -0,0 +1,103 @@
+"""Module for the StatCache class."""
+
+import os as _os
+import stat as _stat
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+
+# Number of paths stat'ed at the same time by `StatCache.prefetch`. On local
+# file systems this hardly matters, but on network file systems it hides the
+# latency of the individual requests.
+_PREFETCH_THREADS = 32
+
+# Number of paths handed to a prefetch thread at once
+_PREFETCH_BATCH_SIZE = 64
+
+
+def _stat_or_none(path):
+    try:
+        return _os.stat(path)
+    except OSError:
+        return None
+
+
+def _stat_batch(paths):
+    return [_stat_or_none(path) for path in paths]
+
+
+class StatCache:
+    """Memoized `os.stat` results, shared by everything that looks at files during a build.
+
+    Many sources include the same headers and objects are checked against
+    all of them, so every path is only stat'ed once. Paths which are known to
+    be needed can be stat'ed in parallel beforehand with :any:`prefetch`.
+
+    The cache has to be cleared, when files may have changed, e.g. before
+    a new build. Files which are written during the build have to be
+    invalidated.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._realpaths = {}
+
+    def stat(self, path):
+        """Return the `os.stat_result` of ``path``, or None if it does not exist."""
+        path = _os.fspath(path)
+        try:
+            return self._stats[path]
+        except KeyError:
+            pass
+        path_stat = self._stats[path] = _stat_or_none(path)
+        return path_stat
+
+    def exists(self, path):
+        """Return whether ``path`` exists."""
+        return self.stat(path) is not None
+
+    def is_file(self, path):
+        """Return whether ``path`` is a regular file (or a link to one)."""
+        path_stat = self.stat(path)
+        return path_stat is not None and _stat.S_ISREG(path_stat.st_mode)
+
+    def is_dir(self, path):
+        """Return whether ``path`` is a directory (or a link to one)."""
+        path_stat = self.stat(path)
+        return path_stat is not None and _stat.S_ISDIR(path_stat.st_mode)
+
+    def prefetch(self, paths):
+        """Stat all of the given paths which are not cached yet, in parallel batches."""
+        missing = list(
+            dict.fromkeys(
+                path for path in map(_os.fspath, paths) if path not in self._stats
+            )
+        )
+        if len(missing) <= _PREFETCH_BATCH_SIZE:
+            for path in missing:
+                self._stats[path] = _stat_or_none(path)
+            return
+
+        batches = [
+            missing[start : start + _PREFETCH_BATCH_SIZE]
+            for start in range(0, len(missing), _PREFETCH_BATCH_SIZE)
+        ]
+        with _ThreadPoolExecutor(max_workers=_PREFETCH_THREADS) as pool:
+            for batch, stats in zip(batches, pool.map(_stat_batch, batches)):
+                self._stats.update(zip(batch, stats))
+
+    def realpath(self, directory):
+        """Return the absolute path of ``directory`` with all symbolic links resolved."""
+        try:
+            return self._realpaths[directory]
+        except KeyError:
+            pass
+        path = self._realpaths[directory] = _os.path.realpath(directory)
+        return path
+
+    def invalidate(self, path):
+        """Forget the cached status of ``path``, e.g. because it was just written."""
+        self._stats.pop(_os.fspath(path), None)
+
+    def clear(self):
+        """Forget the status of all paths."""
+        self._stats = {}
+        self._realpaths = {}
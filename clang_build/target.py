@@ -3,7 +3,7 @@ Target describes a single build or dependency target with all needed paths and
 a list of buildables that comprise it's compile and link steps.
 """
 
-import asyncio as _asyncio
+import json as _json
 import logging as _logging
 import shutil as _shutil
 import subprocess as _subprocess
@@ -11,16 +11,18 @@ from abc import abstractmethod
 from multiprocessing import freeze_support as _freeze_support
 from pathlib import Path as _Path
 
-import json
-
+from .artifact_cache import restored_sources as _restored_sources
+from .build_state import hash_command as _hash_command
 from .directories import Directories
 from .errors import BundleError as _BundleError
-from .errors import CompileError as _CompileError
 from .errors import LinkError as _LinkError
 from .errors import RedistributableError as _RedistributableError
 from .flags import BuildFlags
 from .git_tools import download_sources as _git_download_sources
+from .git_tools import get_commit as _get_commit
+from .git_tools import resolve_commit as _resolve_commit
 from .logging_tools import NamedLogger as _NamedLogger
+from .scheduler import CompileJob as _CompileJob
 from .single_source import SingleSource as _SingleSource
 from .tree_entry import TreeEntry as _TreeEntry
 
@@ -147,6 +149,90 @@ class Target(_TreeEntry, _NamedLogger):
             self._environment.toolchain.platform, target_description.config
         )
 
+        self._configuration = self._get_configuration(target_description.config)
+        self._files = files["sourcefiles"] + self._headers
+        self.fingerprint = self._fingerprint()
+        self.up_to_date = False
+
+        # External targets are shared between build directories through the
+        # artifact cache, see :any:`ArtifactCache`
+        self._artifact_key = target_description.artifact_key
+        self._artifact_build_key = None
+        self._dependency_key = None
+        if self._artifact_key is not None:
+            self._artifact_build_key = self._environment.artifact_cache.build_key(
+                self._artifact_key,
+                [
+                    target._artifact_dependency_key()
+                    for target in self.dependencies + self.public_dependencies
+                ],
+            )
+        self._download_directory = target_description.download_directory
+        self._restored = False
+
+    def _get_configuration(self, config):
+        """Return everything this target is configured from, besides its files and dependencies."""
+        environment = self._environment
+        return [
+            type(self).__name__,
+            self.identifier,
+            environment.build_type.name,
+            str(environment.bundle),
+            _json.dumps(config, sort_keys=True, default=str),
+            *environment.toolchain.identity(),
+            *self._build_flags.final_compile_flags_list(),
+            *self._build_flags.final_link_flags_list(),
+            *self._directories.final_directories_list(),
+            *(f"{prefix}={name}" for prefix, name in environment.path_prefix_map),
+        ]
+
+    def _fingerprint(self):
+        """Return a hash of everything this target is configured from, see :any:`TargetState`."""
+        parts = list(self._configuration)
+        for path in self._files:
+            path_stat = self._environment.stat_cache.stat(path)
+            if path_stat is not None:
+                parts.append(f"{path}:{path_stat.st_size}:{path_stat.st_mtime_ns}")
+        parts += [
+            target.fingerprint
+            for target in self.dependencies + self.public_dependencies
+        ]
+        return _hash_command(parts).hex()
+
+    def _artifact_dependency_key(self):
+        """Return the key of this target as a dependency of external targets, see :any:`ArtifactCache.build_key`.
+
+        Unlike the fingerprint, it is computed from the content of the files
+        of this target and its dependencies, so that it is the same in every
+        clone of the project. It is only computed when needed.
+        """
+        if self._artifact_build_key is not None:
+            return self._artifact_build_key
+        if self._dependency_key is None:
+            self._dependency_key = self._environment.artifact_cache.dependency_key(
+                self._configuration
+                + [
+                    target._artifact_dependency_key()
+                    for target in self.dependencies + self.public_dependencies
+                ],
+                self._files,
+            )
+        return self._dependency_key
+
+    def record_state(self, build_start):
+        """Record the fingerprint of this target after a successful build.
+
+        External targets, which were not restored from the artifact cache,
+        are stored in it.
+        """
+        if self._artifact_key is not None and not self._restored:
+            self._environment.artifact_cache.store(
+                self._artifact_key,
+                self._artifact_build_key,
+                self._download_directory,
+                self.build_directory,
+            )
+
     def __repr__(self) -> str:
         return f"clang_build.target.Target('{self.identifier}')"
 
@@ -162,19 +248,37 @@ class Target(_TreeEntry, _NamedLogger):
         """Overload to add flags from dependencies of this target to its own."""
 
     @abstractmethod
-    def compile(self, process_pool, progress_disabled):
-        """Compile the target, if applicable.
+    def compile_jobs(self):
+        """Return the list of any:`clang_build.scheduler.CompileJob` needed to compile the target.
 
-        This produces an OS-dependent output in the build/bin folder.
+        The jobs produce the object files in the build/obj folder.
         """
 
+    def link_job_dependencies(self, compile_jobs, link_jobs):
+        """Return the jobs which have to be finished before this target can be linked.
+
+        Parameters
+        ----------
+        compile_jobs : dict
+            The list of compile jobs of every target in the build
+        link_jobs : dict
+            The link job of every target in the build, which has already been
+            added to the build graph
+        """
+        return []
+
     @abstractmethod
-    def link(self):
-        """Link the target, if applicable.
+    async def link(self):
+        """Coroutine which links the target, if applicable.
 
         This produces an OS-dependent output in the corresponding build folder:
         - "bin" for executables and shared objects
         - "lib" for static libraries
+
+        Returns
+        -------
+        bool
+            Whether a linker or archiver was run
         """
         pass
 
@@ -240,11 +344,13 @@ class HeaderOnly(Target):
         self._build_flags.make_private_flags_public()
         self._directories.make_private_directories_public()
 
-    def link(self):
+    async def link(self):
         self._logger.info("header-only target does not require linking.")
+        return False
 
-    def compile(self, process_pool, progress_disabled):
+    def compile_jobs(self):
         self._logger.info("header-only target does not require compiling.")
+        return []
 
     def _get_default_flags(self):
         """Return the default any:`clang_build.flags.BuildFlags` without compile or link flags."""
@@ -306,13 +412,49 @@ class Compilable(Target):
         self.outname = target_description.config.get("output_name", self.name)
         self.outfilename = prefix + self.outname + suffix
         self.outfile = (self.output_folder / self.outfilename).resolve()
-
-        compile_flags = self._build_flags.final_compile_flags_list() + platform_flags
+        self._platform_flags = platform_flags
+
+        # A target, which did not change since it was built, does not need
+        # to look at its sources one by one
+        self.up_to_date = (
+            not self._environment.force_build
+            and self._environment.explain_cache is None
+            and self._environment.target_state.is_up_to_date(
+                self.outfile, self.fingerprint
+            )
+        )
+        # The outputs of an external target, which was built before in
+        # another build directory, are copied from the artifact cache
+        if (
+            not self.up_to_date
+            and not self._environment.force_build
+            and self._environment.explain_cache is None
+            and self._artifact_key is not None
+            and not self.outfile.exists()
+            and self._environment.artifact_cache.restore_build(
+                self._artifact_key, self._artifact_build_key, self.build_directory
+            )
+        ):
+            self._logger.info("restored from the artifact cache")
+            self.up_to_date = self._restored = True
+
+        self._buildables = None
+        if not self.up_to_date:
+            self._buildables = self._create_buildables()
+
+    def _create_buildables(self):
+        compile_flags = (
+            self._build_flags.final_compile_flags_list()
+            + self._platform_flags
+            + self._environment.toolchain.path_prefix_map_flags(
+                self._environment.path_prefix_map
+            )
+        )
 
         # Buildables which this Target contains
         include_directories = self._directories.final_directories_list()
 
-        self.buildables = [
+        return [
             _SingleSource(
                 environment=self._environment,
                 source_file=source_file,
@@ -326,8 +468,29 @@ class Compilable(Target):
             for source_file in self.source_files
         ]
 
-        # If compilation of buildables fail, they will be stored here later
-        self._unsuccessful_compilations = []
+    @property
+    def buildables(self):
+        """Return the sources of this target, which are only created when needed for up-to-date targets."""
+        if self._buildables is None:
+            self._buildables = self._create_buildables()
+        return self._buildables
+
+    def record_state(self, build_start):
+        super().record_state(build_start)
+        if self.up_to_date and not self._restored:
+            return
+        build_state = self._environment.build_state
+        outputs = [buildable.object_file for buildable in self.buildables]
+        inputs = []
+        for path in [
+            *(path for output in outputs for path in build_state.inputs(output)),
+            *build_state.inputs(self.outfile),
+        ]:
+            # Objects and libraries of dependencies were built in this build, too
+            (outputs if path in build_state else inputs).append(path)
+        self._environment.target_state.record(
+            self.outfile, self.fingerprint, inputs, outputs, build_start
+        )
 
     def _get_default_flags(self):
         """Return the default any:`clang_build.flags.BuildFlags` with compile flags but without link flags."""
@@ -338,8 +501,14 @@ class Compilable(Target):
             default_compile_flags=True,
         )
 
-    def compile(self, process_pool, progress_disabled):
-        """From the list of source files, compile those which changed or whose dependencies (included headers, ...) changed."""
+    def compile_jobs(self):
+        """From the list of source files, return jobs for those which changed or whose dependencies (included headers, ...) changed."""
+        if self.up_to_date:
+            self._logger.info("target is up to date")
+            return []
+
+        # Until it was built successfully
+        self._environment.target_state.forget(self.outfile)
 
         # Object file only needs to be (re-)compiled if the source file or headers it depends on changed
         if self._environment.force_build:
@@ -352,64 +521,69 @@ class Compilable(Target):
         # If the target was not modified, it may not need to compile
         if not self.needed_buildables:
             self._logger.info("target is already compiled")
-            return
+            return []
 
         self._logger.info(
             "target needs to build sources %s", [b.name for b in self.needed_buildables]
         )
 
-        # Execute depfile generation command
-        #
-        #
-        #    TODO: Remove hardcoded progress bar and use callback function instead
-        #
-        #
-        self._logger.info(f"generate dependency files")
-
-        async def async_generate_depfile():
-            threads = [
-                _asyncio.to_thread(b.generate_depfile) for b in self.needed_buildables
-            ]
-            await _asyncio.gather(*threads)
-
-        _asyncio.run(async_generate_depfile())
-        # Update database with depfile commands
-        self._environment.compilation_database_file.write_text(
-            json.dumps(self._environment.compilation_database, indent=2, sort_keys=True)
-        )
-
-        # Execute compile command
-        self._logger.info("compile object files")
-
-        async def async_compile():
-            threads = [_asyncio.to_thread(b.compile) for b in self.needed_buildables]
-            await _asyncio.gather(*threads)
+        return [_CompileJob(self, buildable) for buildable in self.needed_buildables]
 
-        _asyncio.run(async_compile())
-        # Update database with compile commands
-        self._environment.compilation_database_file.write_text(
-            json.dumps(self._environment.compilation_database, indent=2, sort_keys=True)
-        )
+    def link_job_dependencies(self, compile_jobs, link_jobs):
+        """Wait for the own object files and the outputs of linked dependencies."""
+        return compile_jobs[self] + [
+            link_jobs[target]
+            for target in self._linked_dependencies()
+            if target in link_jobs
+        ]
 
-        # Catch compilation errors
-        self._unsuccessful_compilations = [
-            buildable
-            for buildable in self.needed_buildables
-            if (buildable.compilation_failed or buildable.depfile_failed)
+    def _linked_dependencies(self):
+        """Return the dependencies, whose output is linked into this target."""
+        return [
+            target
+            for target in self.dependencies + self.public_dependencies
+            if target.__class__ is not HeaderOnly
         ]
-        if self._unsuccessful_compilations:
-            raise _CompileError(
-                "Compilation was unsuccessful",
-                {
-                    self.identifier: [
-                        source.compile_report
-                        for source in self._unsuccessful_compilations
-                    ]
-                },
+
+    def _link_command_hash(self, link_arguments):
+        """Return the hash of the arguments passed to the toolchain to link this target."""
+        command = []
+        for argument in link_arguments:
+            if isinstance(argument, (list, tuple)):
+                command += [str(item) for item in argument]
+            else:
+                command.append(str(argument))
+        return _hash_command(command + self._environment.toolchain.identity())
+
+    def _is_linked(self, link_arguments):
+        """Return whether the output is up to date with its inputs and link arguments.
+
+        This is checked when the link job runs, so that dependencies which
+        were linked earlier in the same build are taken into account.
+        """
+        if self._environment.force_build:
+            return False
+        if self._environment.build_state.needs_rebuild(
+            self.outfile, self._link_command_hash(link_arguments)
+        ):
+            return False
+        self._logger.info("target is already linked")
+        return True
+
+    def _record_link(self, success, inputs, link_arguments, output_hash=None):
+        """Record the inputs of the freshly linked output, or that it needs linking."""
+        if success:
+            self._environment.build_state.record(
+                self.outfile,
+                inputs,
+                self._link_command_hash(link_arguments),
+                output_hash,
             )
+        else:
+            self._environment.build_state.forget(self.outfile)
 
-    def link(self):
-        pass
+    async def link(self):
+        return False
 
 
 class Executable(Compilable):
@@ -549,25 +723,30 @@ class Executable(Compilable):
         self._build_flags.forward_public_flags(target)
         self._build_flags.apply_interface_flags(target)
 
-    def link(self):
-        success, self.link_report = self._environment.toolchain.link(
+    async def link(self):
+        if self.up_to_date:
+            return False
+
+        link_arguments = (
             [buildable.object_file for buildable in self.buildables],
             self.outfile,
             self._build_flags._language_flags()
             + self._build_flags.final_link_flags_list(),
-            [
-                target.output_folder.resolve()
-                for target in self.dependencies + self.public_dependencies
-                if target.__class__ is not HeaderOnly
-            ],
-            [
-                target.outname
-                for target in self.dependencies + self.public_dependencies
-                if target.__class__ is not HeaderOnly
-            ],
+            [target.output_folder.resolve() for target in self._linked_dependencies()],
+            [target.outname for target in self._linked_dependencies()],
             False,
             self.is_c_target,
         )
+        inputs = link_arguments[0] + [
+            target.outfile for target in self._linked_dependencies()
+        ]
+        if self._is_linked(link_arguments):
+            return False
+
+        _, success, self.link_report = await self._environment.toolchain.link_async(
+            *link_arguments
+        )
+        self._record_link(success, inputs, link_arguments)
 
         self.unsuccessful_link = not success
 
@@ -576,6 +755,7 @@ class Executable(Compilable):
             raise _LinkError(
                 "Linking was unsuccessful", {self.identifier: self.link_report}
             )
+        return True
 
 
 class SharedLibrary(Compilable):
@@ -659,25 +839,36 @@ class SharedLibrary(Compilable):
         self._build_flags.forward_public_flags(target)
         self._build_flags.apply_interface_flags(target)
 
-    def link(self):
-        success, self.link_report = self._environment.toolchain.link(
+    async def link(self):
+        if self.up_to_date:
+            return False
+
+        link_arguments = (
             [buildable.object_file for buildable in self.buildables],
             self.outfile,
             self._build_flags._language_flags()
             + self._build_flags.final_link_flags_list(),
-            [
-                target.output_folder.resolve()
-                for target in self.dependencies + self.public_dependencies
-                if target.__class__ is not HeaderOnly
-            ],
-            [
-                target.outname
-                for target in self.dependencies + self.public_dependencies
-                if target.__class__ is not HeaderOnly
-            ],
+            [target.output_folder.resolve() for target in self._linked_dependencies()],
+            [target.outname for target in self._linked_dependencies()],
             True,
             self.is_c_target,
         )
+        inputs = link_arguments[0] + [
+            target.outfile for target in self._linked_dependencies()
+        ]
+        if self._is_linked(link_arguments):
+            return False
+
+        _, success, self.link_report = await self._environment.toolchain.link_async(
+            *link_arguments
+        )
+        # Dependents only need to be linked again if the exported symbols change
+        interface_hash = None
+        if success:
+            interface = await self._environment.toolchain.interface_async(self.outfile)
+            if interface is not None:
+                interface_hash = _hash_command(interface)
+        self._record_link(success, inputs, link_arguments, interface_hash)
 
         self.unsuccessful_link = not success
 
@@ -686,6 +877,7 @@ class SharedLibrary(Compilable):
             raise _LinkError(
                 "Linking was unsuccessful", {self.identifier: self.link_report}
             )
+        return True
 
 
 class StaticLibrary(Compilable):
@@ -723,22 +915,64 @@ class StaticLibrary(Compilable):
         self._build_flags.forward_public_flags(target)
         self._build_flags.forward_interface_flags(target)
 
-    def link(self):
+    def link_job_dependencies(self, compile_jobs, link_jobs):
+        """Wait only for the object files which are put into the archive.
+
+        The archive contains the objects of the linked dependencies, so their
+        archives or shared libraries do not need to be finished.
+        """
+        return compile_jobs[self] + [
+            job
+            for target in self._linked_dependencies()
+            for job in compile_jobs.get(target, [])
+        ]
+
+    async def link(self):
         """Although not really a "link" procedure, but really only an archiving procedure
         for simplicity's sake, this is also called link
         """
+        if self.up_to_date:
+            return False
+
         # This library's objects
         objects = [buildable.object_file for buildable in self.buildables]
 
         # Dependencies' objects
-        for target in self.dependencies + self.public_dependencies:
-            if not target.__class__ is HeaderOnly:
-                objects += [buildable.object_file for buildable in target.buildables]
+        for target in self._linked_dependencies():
+            objects += [buildable.object_file for buildable in target.buildables]
 
-        success, self.link_report = self._environment.toolchain.archive(
-            objects, self.outfile, self._build_flags.final_link_flags_list()
+        link_arguments = (
+            objects,
+            self.outfile,
+            self._build_flags.final_link_flags_list(),
         )
 
+        # If the archive was created from the same objects before, only the
+        # changed ones have to be replaced
+        changed_objects = None
+        if not self._environment.force_build:
+            changed_objects = self._environment.build_state.changed_inputs(
+                self.outfile, objects, self._link_command_hash(link_arguments)
+            )
+        if changed_objects == []:
+            self._logger.info("target is already linked")
+            return False
+
+        toolchain = self._environment.toolchain
+        result = None
+        # Members are identified by their file name, which has to be unique
+        if changed_objects and len(set(o.name for o in objects)) == len(objects):
+            self._logger.debug(
+                f"Replacing {len(changed_objects)} of {len(objects)} archive members"
+            )
+            result = await toolchain.update_archive_async(
+                [_Path(o) for o in changed_objects], *link_arguments[1:]
+            )
+        if result is None:
+            result = await toolchain.archive_async(*link_arguments)
+        _, success, self.link_report = result
+        self._record_link(success, objects, link_arguments)
+
         self.unsuccessful_link = not success
 
         # Catch link errors
@@ -746,6 +980,7 @@ class StaticLibrary(Compilable):
             raise _LinkError(
                 "Linking was unsuccessful", {self.identifier: self.link_report}
             )
+        return True
 
 
 TARGET_MAP = {
@@ -811,6 +1046,7 @@ class TargetDescription(_TreeEntry, _NamedLogger):
         self.environment = self.parent_project.environment
         self._relative_directory = self.config.get("directory", "")
         self._download_directory = None
+        self.artifact_key = None
 
         if self.config.get("url"):
             self._download_directory = self.build_directory.parent / "external_sources"
@@ -868,6 +1104,34 @@ class TargetDescription(_TreeEntry, _NamedLogger):
         if self._download_directory:
             url = self.config.get("url", None)
             version = self.config.get("version", None)
+
+            # Sources of a commit, which was built before, are copied from the
+            # artifact cache instead of being cloned
+            artifact_cache = self.environment.artifact_cache
+            restored = _restored_sources(self._download_directory)
+            if artifact_cache is not None:
+                # The remote is only asked for the commit of a branch or tag,
+                # if no sources were restored for it before. Clones are
+                # updated with git instead.
+                commit = None
+                restored_version = restored is not None and (
+                    restored.get("url") == url and restored.get("version") == version
+                )
+                if restored_version:
+                    commit = restored.get("commit")
+                elif not (self._download_directory / ".git").exists():
+                    commit = _resolve_commit(url, version)
+                if commit is not None:
+                    key = self._artifact_key(commit)
+                    if artifact_cache.restore_sources(
+                        key, self._download_directory, url, version, commit
+                    ):
+                        self.artifact_key = key
+                        return
+            elif restored is not None:
+                # Restored sources are no git repository to update
+                _shutil.rmtree(self._download_directory)
+
             _git_download_sources(
                 url,
                 self._download_directory,
@@ -876,6 +1140,27 @@ class TargetDescription(_TreeEntry, _NamedLogger):
                 self.environment.clone_recursive,
             )
 
+            # An existing clone may not have been moved to the commit, which
+            # the remote resolved to, so the key is taken from the checkout
+            if artifact_cache is not None:
+                commit = _get_commit(self._download_directory)
+                if commit is not None:
+                    self.artifact_key = self._artifact_key(commit)
+
+    @property
+    def download_directory(self):
+        """Return the directory of the external sources, or None if the target has none."""
+        return self._download_directory
+
+    def _artifact_key(self, commit):
+        return self.environment.artifact_cache.key(
+            commit,
+            self.config.get("url"),
+            self.config,
+            self.environment.build_type,
+            self.environment.toolchain.identity(),
+        )
+
 
 if __name__ == "__main__":
     _freeze_support()
@@ -0,0 +1,144 @@
+"""Module for the TargetState class."""
+
+import logging as _logging
+import os as _os
+import pickle as _pickle
+from itertools import chain as _chain
+
+from .stat_cache import StatCache as _StatCache
+
+_LOGGER = _logging.getLogger(__name__)
+
+_TARGET_STATE_VERSION = 1
+
+
+def _signature(path_stat):
+    """Return the size and modification time of a file, or None if it does not exist."""
+    if path_stat is None:
+        return None
+    return (path_stat.st_size, path_stat.st_mtime_ns)
+
+
+class TargetState:
+    """The fingerprints of the targets of previous builds, kept in the build directory.
+
+    The fingerprint of a target is a hash of everything it is configured
+    from: its configuration, flags and include directories, the sources and
+    headers found for it together with their sizes and modification times,
+    the toolchain and the fingerprints of its dependencies. It is computed
+    before any of its sources is looked at individually.
+
+    After a successful build, the fingerprint of every built target is
+    recorded, together with the sizes and modification times of the files
+    its outputs depend on beyond its own sources and headers, i.e. the headers
+    of other directories found by the compiler, the linked libraries and the
+    outputs themselves. A target whose fingerprint and recorded files did not
+    change since is up to date as a whole, so that neither the compile
+    commands of its sources nor their dependencies have to be checked.
+
+    Targets are identified by their output, which is different for every
+    build type.
+    """
+
+    def __init__(self, path, stat_cache=None):
+        """Load the target state from ``path``, if it exists.
+
+        An unreadable or outdated state is discarded. Files are looked at
+        through the given :any:`StatCache`, or a new one.
+        """
+        self._path = path
+        self._stat_cache = _StatCache() if stat_cache is None else stat_cache
+        self._entries = {}
+        self._modified = False
+        if self._path.exists():
+            try:
+                with open(self._path, "rb") as state_file:
+                    content = _pickle.load(state_file)
+                if content.get("version") == _TARGET_STATE_VERSION:
+                    self._entries = dict(content["entries"])
+            except (
+                OSError,
+                EOFError,
+                _pickle.UnpicklingError,
+                AttributeError,
+                KeyError,
+                TypeError,
+                ValueError,
+            ):
+                _LOGGER.debug(f'Discarding unreadable target state "{self._path}"')
+
+    def prefetch(self):
+        """Stat the recorded files of all targets at once, see :any:`StatCache.prefetch`."""
+        self._stat_cache.prefetch(
+            _chain.from_iterable(entry[1] for entry in self._entries.values())
+        )
+
+    def is_up_to_date(self, output, fingerprint):
+        """Return whether the target was built with this fingerprint and its recorded files did not change."""
+        entry = self._entries.get(str(output))
+        if entry is None or entry[0] != fingerprint:
+            return False
+        return all(
+            _signature(self._stat_cache.stat(path)) == signature
+            for path, signature in zip(entry[1], entry[2])
+        )
+
+    def record(self, output, fingerprint, inputs, outputs, build_start):
+        """Record the fingerprint and files of a target, which was built successfully.
+
+        Parameters
+        ----------
+        output : pathlib.Path
+            The output of the target, e.g. the linked executable
+        fingerprint : str
+            The fingerprint of the target
+        inputs : list
+            Files the outputs of the target were built from, which are not
+            covered by the fingerprint
+        outputs : list
+            Other files built for the target, e.g. its object files, or the
+            libraries of dependencies it was linked with
+        build_start : int
+            Time in nanoseconds since the epoch, when the build started.
+            Nothing is recorded if an input was modified since then, because
+            the build may have seen a different version of it.
+
+        """
+        outputs = set(str(path) for path in [output, *outputs])
+        paths = []
+        signatures = []
+        for path in dict.fromkeys(_chain(map(str, inputs), sorted(outputs))):
+            try:
+                path_stat = _os.stat(path)
+            except OSError:
+                self.forget(output)
+                return
+            paths.append(path)
+            signatures.append(_signature(path_stat))
+            if path_stat.st_mtime_ns >= build_start and path not in outputs:
+                self.forget(output)
+                return
+
+        self._entries[str(output)] = (fingerprint, tuple(paths), tuple(signatures))
+        self._modified = True
+
+    def forget(self, output):
+        """Remove the target, so that its sources and outputs are checked by the next build."""
+        if self._entries.pop(str(output), None) is not None:
+            self._modified = True
+
+    def save(self):
+        """Write the target state to disk, if it was modified."""
+        if not self._modified:
+            return
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self._path.with_name(self._path.name + ".tmp")
+        with open(temporary_path, "wb") as state_file:
+            _pickle.dump(
+                {"version": _TARGET_STATE_VERSION, "entries": self._entries},
+                state_file,
+                protocol=_pickle.HIGHEST_PROTOCOL,
+            )
+        _os.replace(temporary_path, self._path)
+        self._modified = False
@@ -1,10 +1,13 @@
 """Module containing tool chaines used for compiling and linking."""
 
 from abc import abstractmethod
+import asyncio as _asyncio
 import logging as _logging
+import os as _os
 import shutil as _shutil
 import subprocess as _subprocess
 from functools import lru_cache as _lru_cache
+from inspect import signature as _signature
 from pathlib import Path as _Path
 from re import search as _search
 from sys import version_info as _version_info
@@ -13,6 +16,8 @@ from sysconfig import get_paths as _get_paths
 from sysconfig import get_config_var as _get_config_var
 
 from .build_type import BuildType
+from .process_tools import run_command as _run_command
+from .process_tools import run_command_async as _run_command_async
 
 _LOGGER = _logging.getLogger(__name__)
 
@@ -26,6 +31,22 @@ class Toolchain:
         BuildType.Coverage: [],
     }
 
+    # Environment variables which change the output of the compilers
+    COMPILE_ENVIRONMENT_VARIABLES = [
+        "CPATH",
+        "C_INCLUDE_PATH",
+        "CPLUS_INCLUDE_PATH",
+        "OBJC_INCLUDE_PATH",
+        "CCC_OVERRIDE_OPTIONS",
+        "SDKROOT",
+        "MACOSX_DEPLOYMENT_TARGET",
+    ]
+
+    # Whether dependency files also list system headers, e.g. those found
+    # through `-isystem` or a sysroot. The compile cache needs them, because
+    # its cached object files are only valid as long as all headers match.
+    system_header_dependencies = False
+
     DEFAULT_LINK_FLAGS = {
         BuildType.Default: [],
         BuildType.Release: [],
@@ -117,12 +138,75 @@ class Toolchain:
 
         _LOGGER.info("Platform: %s", self.platform)
 
-    @abstractmethod
+    def compile_command(
+        self, source_file, object_file, include_directories, flags, is_c_target
+    ):
+        """Return the command `compile` would run, if the toolchain can tell.
+
+        Object files are rebuilt when this command changes. Toolchains which
+        return None are identified by the given parameters instead.
+
+        Returns
+        -------
+        list of str
+            The compile command, without the flags for the dependency file,
+            or None
+
+        """
+        return None
+
+    @_lru_cache(maxsize=1)
+    def identity(self):
+        """Return strings identifying the tools and the environment of this toolchain.
+
+        Object files are rebuilt when these change. By default, they consist
+        of the path, size and modification time of the compilers and the
+        values of the `COMPILE_ENVIRONMENT_VARIABLES`.
+
+        Returns
+        -------
+        list of str
+            The identity of the toolchain
+
+        """
+        identity = [type(self).__qualname__]
+        for compiler in [self.c_compiler, self.cpp_compiler]:
+            if compiler is None:
+                continue
+            try:
+                compiler_stat = _os.stat(compiler)
+                identity.append(
+                    f"{compiler}:{compiler_stat.st_size}:{compiler_stat.st_mtime_ns}"
+                )
+            except OSError:
+                identity.append(str(compiler))
+        for variable in self.COMPILE_ENVIRONMENT_VARIABLES:
+            if variable in _os.environ:
+                identity.append(f"{variable}={_os.environ[variable]}")
+        return identity
+
+    def path_prefix_map_flags(self, path_prefix_map):
+        """Return the compile flags, which make the compiler apply a :any:`PathPrefixMap`.
+
+        The paths written into object files, e.g. for debug information or
+        ``__FILE__``, are then relative to the project root. Toolchains which
+        cannot do this return no flags.
+        """
+        return []
+
     def generate_dependency_file(
         self, source_file, dependency_file, flags, include_directories, is_c_target
     ):
         """Generate a dependency file for a given source file.
 
+        This is only used for toolchains whose :any:`compile` does not take a
+        ``dependency_file``, i.e. which were written for older versions of
+        clang-build. Other toolchains should write the dependency file during
+        compilation instead of running the compiler twice.
+
+        By default, the preprocessor of the `c_compiler` or `cpp_compiler` is
+        run with the GCC-compatible ``-MMD`` (or ``-MD``) and ``-MF`` flags.
+
         If the dependency file is placed into a non-existing folder, this
         folder is generated before compilation.
 
@@ -139,16 +223,50 @@ class Toolchain:
 
         Returns
         -------
+        list of str
+            The command that was run
         bool
             True if the dependency file generation was successful, else False
         str
             Output of the compiler
 
         """
+        dependency_file.parent.mkdir(parents=True, exist_ok=True)
+
+        compiler = self.c_compiler if is_c_target else self.cpp_compiler
+        command = (
+            [str(compiler), "-E", str(source_file), "-o", _os.devnull]
+            + flags
+            + [
+                item
+                for include_directory in include_directories
+                for item in ["-I", str(include_directory)]
+            ]
+            + [
+                "-MD" if self.system_header_dependencies else "-MMD",
+                "-MF",
+                str(dependency_file),
+            ]
+        )
+        _LOGGER.debug(f"Running: {' '.join(command)}")
+        return command, *_run_command(command)
+
+    def _compile_takes_dependency_file(self):
+        """Return whether :any:`compile` accepts the ``dependency_file`` parameter."""
+        parameters = _signature(self.compile).parameters
+        return "dependency_file" in parameters or any(
+            parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values()
+        )
 
     @abstractmethod
     def compile(
-        self, source_file, object_file, include_directories, flags, is_c_target
+        self,
+        source_file,
+        object_file,
+        include_directories,
+        flags,
+        is_c_target,
+        dependency_file=None,
     ):
         """Compile a given source file into an object file.
 
@@ -166,8 +284,14 @@ class Toolchain:
         flags : list of str
             List of flags to pass to the compiler
 
+        dependency_file : pathlib.Path
+            Optional. A dependency file listing the headers of the source file,
+            which should be written as a side-effect of the compilation
+
         Returns
         -------
+        list of str
+            The command that was run
         bool
             True if the compilation was successful, else False
         str
@@ -239,6 +363,188 @@ class Toolchain:
 
         """
 
+    async def compile_async(
+        self,
+        source_file,
+        object_file,
+        include_directories,
+        flags,
+        is_c_target,
+        dependency_file=None,
+    ):
+        """Coroutine version of :any:`compile`, with the same parameters and return values.
+
+        By default, :any:`compile` is run in a separate thread, so that
+        toolchains which only implement the blocking functions can be used
+        by the asynchronous build.
+
+        For toolchains whose :any:`compile` does not take a ``dependency_file``,
+        it is generated by :any:`generate_dependency_file` before compiling.
+        """
+        if not self._compile_takes_dependency_file():
+            if dependency_file is not None:
+                command, success, output = await _asyncio.to_thread(
+                    self.generate_dependency_file,
+                    source_file,
+                    dependency_file,
+                    flags,
+                    include_directories,
+                    is_c_target,
+                )
+                if not success:
+                    return command, success, output
+            return await _asyncio.to_thread(
+                self.compile,
+                source_file,
+                object_file,
+                include_directories,
+                flags,
+                is_c_target,
+            )
+
+        return await _asyncio.to_thread(
+            self.compile,
+            source_file,
+            object_file,
+            include_directories,
+            flags,
+            is_c_target,
+            dependency_file,
+        )
+
+    async def link_async(
+        self,
+        object_files,
+        output_file,
+        flags,
+        library_directories,
+        libraries,
+        is_library,
+        is_c_target,
+    ):
+        """Coroutine version of :any:`link`.
+
+        By default, :any:`link` is run in a separate thread.
+
+        Returns
+        -------
+        list of str
+            The command that was run, or None if it is not known
+        bool
+            True if linking was successful, False otherwise
+        str
+            The output of the linker
+
+        """
+        return (
+            None,
+            *await _asyncio.to_thread(
+                self.link,
+                object_files,
+                output_file,
+                flags,
+                library_directories,
+                libraries,
+                is_library,
+                is_c_target,
+            ),
+        )
+
+    async def archive_async(self, object_files, output_file, flags):
+        """Coroutine version of :any:`archive`.
+
+        By default, :any:`archive` is run in a separate thread.
+
+        Returns
+        -------
+        list of str
+            The command that was run, or None if it is not known
+        bool
+            True if archiving was successful, False otherwise
+        str
+            The output of the archiver
+
+        """
+        return (
+            None,
+            *await _asyncio.to_thread(self.archive, object_files, output_file, flags),
+        )
+
+    def update_archive(self, object_files, output_file, flags):
+        """Replace the given object files in an existing static library.
+
+        Members of the same name are replaced, all other members are kept.
+        Toolchains which cannot do this return None, in which case the
+        whole static library is created again with :any:`archive`.
+
+        Parameters
+        ----------
+        object_files : list of pathlib.Path
+            Object files to replace in the static library
+        output_file : pathlib.Path
+            The static library to update
+        flags : list of str
+            Flags to pass to the archiver
+
+        Returns
+        -------
+        bool
+            True if archiving was successful, False otherwise
+        str
+            The output of the archiver
+
+        """
+        return None
+
+    async def update_archive_async(self, object_files, output_file, flags):
+        """Coroutine version of :any:`update_archive`.
+
+        By default, :any:`update_archive` is run in a separate thread.
+
+        Returns
+        -------
+        list of str
+            The command that was run, or None if it is not known
+        bool
+            True if archiving was successful, False otherwise
+        str
+            The output of the archiver
+
+        """
+        result = await _asyncio.to_thread(
+            self.update_archive, object_files, output_file, flags
+        )
+        return None if result is None else (None, *result)
+
+    def interface(self, shared_library):
+        """Return the symbols exported by a shared library.
+
+        Targets linked against a shared library are only linked again if its
+        interface changed, so this has to contain everything they depend on,
+        but nothing which changes with the implementation alone. Toolchains
+        which cannot determine it return None, in which case the whole
+        content of the shared library is compared.
+
+        Parameters
+        ----------
+        shared_library : pathlib.Path
+            The freshly linked shared library
+
+        Returns
+        -------
+        list of str
+            The exported symbols, or None if they are not known
+
+        """
+        return None
+
+    async def interface_async(self, shared_library):
+        """Coroutine version of :any:`interface`.
+
+        By default, :any:`interface` is run in a separate thread.
+        """
+        return await _asyncio.to_thread(self.interface, shared_library)
+
 
 class LLVM(Toolchain):
     """The LLVM toolchain: clang and clang++ compilers, etc.
@@ -254,6 +560,8 @@ class LLVM(Toolchain):
         Path to the `clang++` executable
     archiver : :any:`pathlib.Path`
         Path to the `llvm-ar` executable
+    symbol_lister : :any:`pathlib.Path`
+        Path to the `llvm-nm` executable, or None if it was not found
     max_cpp_standard : str
         Compile flag for the latest supported
         C++ standard of the found compiler
@@ -363,9 +671,15 @@ class LLVM(Toolchain):
 
     _UNSUPPORTED_DIALECT_MESSAGE = "error: invalid value 'c++{0:02d}'"
 
-    def __init__(self):
+    def __init__(self, probe_cache=None):
         """Search for clang and detect compiler features.
 
+        Parameters
+        ----------
+        probe_cache : ProbeCache
+            Optional. Keeps the detected features of the compiler across
+            runs. Without it, the compiler is probed every time.
+
         Raises
         ------
         RuntimeError
@@ -377,6 +691,11 @@ class LLVM(Toolchain):
         self.c_compiler = self._find("clang")
         self.cpp_compiler = self._find("clang++")
         self.archiver = self._find("llvm-ar")
+        symbol_lister = _shutil.which("llvm-nm")
+        self.symbol_lister = _Path(symbol_lister) if symbol_lister else None
+
+        # Features of the compiler found by previous runs
+        self._probe_cache = probe_cache
 
         self.max_cpp_standard = self._get_max_supported_compiler_dialect()
 
@@ -395,6 +714,7 @@ class LLVM(Toolchain):
         _LOGGER.info("clang executable:    %s", self.c_compiler)
         _LOGGER.info("clang++ executable:  %s", self.cpp_compiler)
         _LOGGER.info("llvm-ar executable:  %s", self.archiver)
+        _LOGGER.info("llvm-nm executable:  %s", self.symbol_lister)
         _LOGGER.info("Newest supported C++ dialect: %s", self.max_cpp_standard)
         _LOGGER.info(
             "Python headers in:   %s",
@@ -432,6 +752,12 @@ class LLVM(Toolchain):
             _LOGGER.error(error_message)
             raise RuntimeError(error_message)
 
+    def _probe(self, name, function):
+        """Return the result of probing the compiler, from the probe cache if there is one."""
+        if self._probe_cache is None:
+            return function()
+        return self._probe_cache.probe(self.cpp_compiler, name, function)
+
     def _get_dialect_flag(self, year):
         """Return a dialect flag for a given year.
 
@@ -466,6 +792,10 @@ class LLVM(Toolchain):
             by clang.
 
         """
+        return self._probe(f"dialect_exists:{year}", lambda: self._probe_dialect(year))
+
+    def _probe_dialect(self, year):
+        """Run clang with the dialect flag for a given year, see :any:`dialect_exists`."""
         std_opt = self._get_dialect_flag(year)
         try:
             _subprocess.run(
@@ -493,6 +823,13 @@ class LLVM(Toolchain):
             Flag string of the latest supported dialect
 
         """
+        return self._probe(
+            "max_supported_compiler_dialect",
+            self._probe_max_supported_compiler_dialect,
+        )
+
+    def _probe_max_supported_compiler_dialect(self):
+        """Run clang to find the latest supported C++ dialect, see :any:`_get_max_supported_compiler_dialect`."""
         _, report = self._run_clang_command(
             [str(self.cpp_compiler), "-std=dummpy", "-x", "c++", "-E", "-"]
         )
@@ -525,52 +862,132 @@ class LLVM(Toolchain):
 
     def _run_clang_command(self, command):
         _LOGGER.debug(f"Running: {' '.join(command)}")
-        try:
-            return (
-                True,
-                _subprocess.check_output(
-                    command, encoding="utf8", stderr=_subprocess.STDOUT
-                ),
-            )
-        except _subprocess.CalledProcessError as error:
-            return False, error.output.strip()
+        return _run_command(command)
 
-    def generate_dependency_file(
-        self, source_file, dependency_file, flags, include_directories, is_c_target
+    async def _run_clang_command_async(self, command):
+        _LOGGER.debug(f"Running: {' '.join(command)}")
+        return await _run_command_async(command)
+
+    def compile_command(
+        self, source_file, object_file, include_directories, flags, is_c_target
     ):
-        """Generate a dependency file for a given source file.
+        return self._get_compiler_command(
+            source_file, object_file, include_directories, flags, is_c_target
+        )
 
-        If the dependency file is placed into a non-existing folder, this
-        folder is generated before compilation.
+    def path_prefix_map_flags(self, path_prefix_map):
+        # `-ffile-prefix-map` implies `-fdebug-prefix-map` and `-fmacro-prefix-map`.
+        # The most specific prefix comes last, as the last matching one is used.
+        return [
+            f"-ffile-prefix-map={prefix}={name}"
+            for prefix, name in reversed(list(path_prefix_map))
+        ]
 
-        Parameters
-        ----------
-        source_file : pathlib.Path
-            The source file to compile
+    def _prepare_compile_command(
+        self,
+        source_file,
+        object_file,
+        include_directories,
+        flags,
+        is_c_target,
+        dependency_file,
+    ):
+        object_file.parents[0].mkdir(parents=True, exist_ok=True)
 
-        dependency_file : pathlib.Path
-            The dependency file to generate
+        command = self._get_compiler_command(
+            source_file, object_file, include_directories, flags, is_c_target
+        )
+        if dependency_file:
+            dependency_file.parents[0].mkdir(parents=True, exist_ok=True)
+            command += [
+                "-MD" if self.system_header_dependencies else "-MMD",
+                "-MF",
+                str(dependency_file),
+            ]
 
-        flags : list of str
-            List of flags to pass to the compiler
+        return command
 
-        Returns
-        -------
-        bool
-            True if the dependency file generation was successful, else False
-        str
-            Output of the compiler
+    def _prepare_link_command(
+        self,
+        object_files,
+        output_file,
+        flags,
+        library_directories,
+        libraries,
+        is_library,
+        is_c_target,
+    ):
+        _LOGGER.info(f'link -> "{output_file}"')
+        output_file.parents[0].mkdir(parents=True, exist_ok=True)
 
-        """
-        dependency_file.parents[0].mkdir(parents=True, exist_ok=True)
+        command = (
+            self._get_compiler(is_c_target)
+            + (["-shared"] if is_library else [])
+            + ["-o", str(output_file)]
+        )
+        command += [str(o) for o in object_files]
+        command += flags
+        command += ["-L" + str(directory) for directory in library_directories]
+        command += ["-l" + str(library) for library in libraries]
 
-        command = self._get_compiler_command(
-            source_file, None, include_directories, flags, is_c_target
-        ) + ["-E", "-MMD", str(source_file), "-MF", str(dependency_file)]
-        return command, *self._run_clang_command(command)
+        return command
+
+    def _prepare_archive_command(self, object_files, output_file, flags):
+        output_file.parents[0].mkdir(parents=True, exist_ok=True)
+
+        # Start from scratch, so that no members of removed sources are kept.
+        # Deterministic mode ("D") makes the archive independent of the
+        # timestamps, owners and permissions of the object files.
+        if output_file.exists():
+            output_file.unlink()
+
+        return [str(self.archiver), "rcD", str(output_file)] + [
+            str(o) for o in object_files
+        ]
+
+    def _prepare_update_archive_command(self, object_files, output_file, flags):
+        return [str(self.archiver), "rD", str(output_file)] + [
+            str(o) for o in object_files
+        ]
+
+    def _prepare_interface_command(self, shared_library):
+        # On Windows, dependents link against the import library instead
+        if self.symbol_lister is None or self.platform == "windows":
+            return None
+        return (
+            [str(self.symbol_lister)]
+            + (["--dynamic"] if self.platform == "linux" else [])
+            + ["--defined-only", "--extern-only", "--format=posix"]
+            + [str(shared_library)]
+        )
+
+    @staticmethod
+    def _parse_interface(output):
+        """Return the exported symbols from the output of `llvm-nm --format=posix`.
+
+        Each line consists of the name, type, address and size of a symbol.
+        Addresses change with the implementation and are dropped, while the
+        sizes of data symbols are kept, as they are copied into executables.
+        """
+        symbols = []
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if fields[1] in "BbDdGgRrSsVv" and len(fields) > 3:
+                symbols.append(" ".join([fields[0], fields[1], fields[3]]))
+            else:
+                symbols.append(" ".join(fields[:2]))
+        return sorted(symbols)
 
     def compile(
-        self, source_file, object_file, include_directories, flags, is_c_target
+        self,
+        source_file,
+        object_file,
+        include_directories,
+        flags,
+        is_c_target,
+        dependency_file=None,
     ):
         """Compile a given source file into an object file.
 
@@ -588,21 +1005,50 @@ class LLVM(Toolchain):
         flags : list of str
             List of flags to pass to the compiler
 
+        dependency_file : pathlib.Path
+            Optional. If given, clang writes the list of (non-system) headers
+            the source file depends on into this file while compiling, so
+            that no separate preprocessing pass is needed
+
         Returns
         -------
+        list of str
+            The command that was run
         bool
             True if the compilation was successful, else False
         str
             Output of the compiler
 
         """
-        object_file.parents[0].mkdir(parents=True, exist_ok=True)
-
-        command = self._get_compiler_command(
-            source_file, object_file, include_directories, flags, is_c_target
+        command = self._prepare_compile_command(
+            source_file,
+            object_file,
+            include_directories,
+            flags,
+            is_c_target,
+            dependency_file,
         )
         return command, *self._run_clang_command(command)
 
+    async def compile_async(
+        self,
+        source_file,
+        object_file,
+        include_directories,
+        flags,
+        is_c_target,
+        dependency_file=None,
+    ):
+        command = self._prepare_compile_command(
+            source_file,
+            object_file,
+            include_directories,
+            flags,
+            is_c_target,
+            dependency_file,
+        )
+        return command, *await self._run_clang_command_async(command)
+
     def link(
         self,
         object_files,
@@ -613,26 +1059,64 @@ class LLVM(Toolchain):
         is_library,
         is_c_target,
     ):
-        _LOGGER.info(f'link -> "{output_file}"')
-        output_file.parents[0].mkdir(parents=True, exist_ok=True)
-
-        command = (
-            self._get_compiler(is_c_target)
-            + (["-shared"] if is_library else [])
-            + ["-o", str(output_file)]
+        command = self._prepare_link_command(
+            object_files,
+            output_file,
+            flags,
+            library_directories,
+            libraries,
+            is_library,
+            is_c_target,
         )
-        command += [str(o) for o in object_files]
-        command += flags
-        command += ["-L" + str(directory) for directory in library_directories]
-        command += ["-l" + str(library) for library in libraries]
-
         return self._run_clang_command(command)
 
+    async def link_async(
+        self,
+        object_files,
+        output_file,
+        flags,
+        library_directories,
+        libraries,
+        is_library,
+        is_c_target,
+    ):
+        command = self._prepare_link_command(
+            object_files,
+            output_file,
+            flags,
+            library_directories,
+            libraries,
+            is_library,
+            is_c_target,
+        )
+        return command, *await self._run_clang_command_async(command)
+
     def archive(self, object_files, output_file, flags):
-        output_file.parents[0].mkdir(parents=True, exist_ok=True)
+        command = self._prepare_archive_command(object_files, output_file, flags)
+        return self._run_clang_command(command)
 
-        command = [str(self.archiver), "rc", str(output_file)] + [
-            str(o) for o in object_files
-        ]
+    async def archive_async(self, object_files, output_file, flags):
+        command = self._prepare_archive_command(object_files, output_file, flags)
+        return command, *await self._run_clang_command_async(command)
 
+    def update_archive(self, object_files, output_file, flags):
+        command = self._prepare_update_archive_command(object_files, output_file, flags)
         return self._run_clang_command(command)
+
+    async def update_archive_async(self, object_files, output_file, flags):
+        command = self._prepare_update_archive_command(object_files, output_file, flags)
+        return command, *await self._run_clang_command_async(command)
+
+    def interface(self, shared_library):
+        command = self._prepare_interface_command(shared_library)
+        if command is None:
+            return None
+        success, output = self._run_clang_command(command)
+        return self._parse_interface(output) if success else None
+
+    async def interface_async(self, shared_library):
+        command = self._prepare_interface_command(shared_library)
+        if command is None:
+            return None
+        success, output = await self._run_clang_command_async(command)
+        return self._parse_interface(output) if success else None
@@ -1,10 +1,13 @@
 import os, sys
+import asyncio
 import unittest
+import unittest.mock
 import subprocess
 import shutil
 import logging
 import io
 import stat
+import threading
 from pathlib import Path as _Path
 from multiprocessing import freeze_support
 from sys import platform as _platform
@@ -13,6 +16,16 @@ import json
 
 from clang_build import cli
 from clang_build import toolchain
+from clang_build.artifact_cache import ArtifactCache
+from clang_build.build_state import BuildState
+from clang_build.cache_server import CacheServer
+from clang_build.compile_cache import CompileCache
+from clang_build.configuration_cache import ConfigurationCache
+from clang_build.depfile import parse_depfile_text
+from clang_build.probe_cache import ProbeCache
+from clang_build.stat_cache import StatCache
+from clang_build.environment import Environment
+from clang_build.project import Project
 from clang_build.errors import CompileError
 from clang_build.errors import LinkError
 from clang_build.logging_tools import TqdmHandler as TqdmHandler
@@ -164,6 +177,469 @@ class TestClangBuild(unittest.TestCase):
         # logger.removeHandler(ch)
         # self.assertRegex(stream_capture.getvalue(), r'.*\[main\]: target needs to build sources*')
 
+    def test_build_log(self):
+        clang_build_try_except(["-d", "test/mwe"])
+
+        build_log_file = _Path("build") / ".clang_build_log"
+        self.assertTrue(build_log_file.exists())
+
+        entries = json.loads(build_log_file.read_text())["entries"]
+        for output in ["build/default/obj/hello.o", "build/default/bin/main"]:
+            entry = entries[str(_Path(output).resolve())]
+            self.assertGreater(entry["duration"], 0)
+            if hasattr(os, "pidfd_open") and hasattr(os, "wait4"):
+                self.assertGreater(entry["peak_memory"], 0)
+
+        # A build with nothing to do keeps the durations of the previous one
+        clang_build_try_except(["-d", "test/mwe"])
+        self.assertEqual(json.loads(build_log_file.read_text())["entries"], entries)
+
+    def test_build_state(self):
+        clang_build_try_except(["-d", "test/mwe_with_default_folders"])
+
+        object_file = _Path("build/default/obj/main.o").resolve()
+        stat_cache = StatCache()
+        build_state = BuildState(
+            _Path("build") / ".clang_build_deps", False, stat_cache
+        )
+        self.assertFalse(build_state.needs_rebuild(object_file))
+        self.assertTrue(build_state.needs_rebuild(object_file, b"another command"))
+        executable = _Path("build/default/bin/main").resolve()
+        self.assertFalse(build_state.needs_rebuild(executable))
+
+        header = _Path("test/mwe_with_default_folders/include/smallfunctions.hpp")
+        header_stat = header.stat()
+        try:
+            newer = object_file.stat().st_mtime + 10
+            os.utime(header, (header_stat.st_atime, newer))
+            stat_cache.clear()
+            self.assertTrue(build_state.needs_rebuild(object_file))
+        finally:
+            os.utime(header, (header_stat.st_atime, header_stat.st_mtime))
+
+    def test_early_cutoff(self):
+        clang_build_try_except(["-d", "test/mwe_with_default_folders"])
+
+        object_file = _Path("build/default/obj/main.o").resolve()
+        executable = _Path("build/default/bin/main").resolve()
+        object_mtime = object_file.stat().st_mtime_ns
+        executable_mtime = executable.stat().st_mtime_ns
+
+        source = _Path("test/mwe_with_default_folders/main.cpp")
+        source_stat = source.stat()
+        try:
+            newer = object_file.stat().st_mtime + 10
+            os.utime(source, (source_stat.st_atime, newer))
+            clang_build_try_except(["-d", "test/mwe_with_default_folders"])
+        finally:
+            os.utime(source, (source_stat.st_atime, source_stat.st_mtime))
+
+        self.assertNotEqual(object_file.stat().st_mtime_ns, object_mtime)
+        self.assertEqual(executable.stat().st_mtime_ns, executable_mtime)
+
+    def test_incremental_archive(self):
+        directory = _Path("build/archived")
+        (directory / "src").mkdir(parents=True)
+        (directory / "src" / "a.cpp").write_text("int a() { return 1; }\n")
+        (directory / "src" / "b.cpp").write_text("int b() { return 2; }\n")
+        (directory / "clang-build.toml").write_text(
+            '[mylib]\ntarget_type = "static library"\n'
+        )
+        clang_build_try_except(["-d", str(directory)])
+
+        archive = _Path("build/default/lib/libmylib.a")
+        members = subprocess.check_output(["llvm-ar", "t", archive]).split()
+        self.assertEqual(len(members), 2)
+
+        updates = []
+        update_archive_async = toolchain.LLVM.update_archive_async
+
+        async def record_update(self, object_files, output_file, flags):
+            updates.append([object_file.name for object_file in object_files])
+            return await update_archive_async(self, object_files, output_file, flags)
+
+        (directory / "src" / "a.cpp").write_text("int a_changed() { return 1; }\n")
+        with unittest.mock.patch.object(
+            toolchain.LLVM, "update_archive_async", record_update
+        ):
+            clang_build_try_except(["-d", str(directory)])
+
+        # Only the changed object file is replaced in the archive
+        self.assertEqual(updates, [["a.o"]])
+        self.assertEqual(
+            subprocess.check_output(["llvm-ar", "t", archive]).split(), members
+        )
+        symbols = subprocess.check_output(["llvm-nm", archive]).decode()
+        self.assertIn("a_changed", symbols)
+        self.assertIn("_Z1bv", symbols)
+
+    def test_target_fingerprint(self):
+        clang_build_try_except(["-d", "test/mwe_with_default_folders"])
+
+        def configure():
+            args = cli.parse_args(["-d", "test/mwe_with_default_folders"])
+            environment = Environment(vars(args))
+            return Project.from_directory(
+                _Path(args.directory), environment
+            ).configure()
+
+        self.assertTrue(all(target.up_to_date for target in configure()))
+
+        header = _Path("test/mwe_with_default_folders/include/smallfunctions.hpp")
+        header_stat = header.stat()
+        try:
+            os.utime(header, (header_stat.st_atime, header_stat.st_mtime + 10))
+            self.assertFalse(any(target.up_to_date for target in configure()))
+        finally:
+            os.utime(header, (header_stat.st_atime, header_stat.st_mtime))
+
+    def test_artifact_cache(self):
+        repository = _Path("build/external_repository").resolve()
+        (repository / "include").mkdir(parents=True)
+        (repository / "src").mkdir()
+        (repository / "include" / "mylib.hpp").write_text("int mylib();\n")
+        (repository / "src" / "mylib.cpp").write_text(
+            '#include "mylib.hpp"\nint mylib() { return 42; }\n'
+        )
+        git = ["git", "-c", "user.name=test", "-c", "user.email=test@test"]
+        subprocess.run(["git", "init", "-q"], cwd=repository, check=True)
+        subprocess.run(git + ["add", "."], cwd=repository, check=True)
+        subprocess.run(git + ["commit", "-qm", "mylib"], cwd=repository, check=True)
+
+        project = _Path("build/external_project")
+        (project / "settings" / "include").mkdir(parents=True)
+        (project / "settings" / "include" / "settings.hpp").write_text(
+            "#define SETTING 1\n"
+        )
+        (project / "main.cpp").write_text(
+            '#include "mylib.hpp"\nint main() { return mylib() != 42; }\n'
+        )
+        (project / "clang-build.toml").write_text(
+            "[settings]\n"
+            'target_type = "header only"\n'
+            'directory = "settings"\n'
+            "[mylib]\n"
+            'target_type = "static library"\n'
+            f'url = "{repository.as_posix()}"\n'
+            'dependencies = ["settings"]\n'
+            "[app]\n"
+            'target_type = "executable"\n'
+            'dependencies = ["mylib"]\n'
+        )
+
+        cache_args = ["--cache", "--cache-dir", "build/cache"]
+        clang_build_try_except(["-d", str(project)] + cache_args)
+        self.assertEqual(CompileCache("build/cache").stats()["artifacts"], 1)
+
+        # A new build directory of another clone of the project restores the
+        # sources and the library
+        clone = _Path("build/external_project_clone")
+        shutil.copytree(project, clone, copy_function=shutil.copy)
+        for path in ["build/mylib", "build/app"]:
+            shutil.rmtree(path, onerror=on_rm_error)
+        _Path("build/.clang_build_targets").unlink(missing_ok=True)
+        restored = []
+        restore_build = ArtifactCache.restore_build
+
+        def record_restore(self, *args):
+            restored.append(restore_build(self, *args))
+            return restored[-1]
+
+        with unittest.mock.patch.object(ArtifactCache, "restore_build", record_restore):
+            clang_build_try_except(["-d", str(clone)] + cache_args)
+
+        self.assertEqual(restored, [True])
+        self.assertFalse(_Path("build/mylib/external_sources/.git").exists())
+        self.assertTrue(_Path("build/mylib/default/lib/libmylib.a").exists())
+        self.assertEqual(subprocess.call(["./build/app/default/bin/app"]), 0)
+
+        # The remote is not asked again for the commit of restored sources
+        with unittest.mock.patch(
+            "clang_build.target._resolve_commit", side_effect=AssertionError
+        ):
+            clang_build_try_except(["-d", str(clone)] + cache_args)
+
+    def test_configuration_cache(self):
+        directory = _Path("build/configured").resolve()
+        (directory / "src").mkdir(parents=True)
+        (directory / "src" / "main.cpp").write_text("int main() { return 0; }\n")
+
+        def sources():
+            cache = ConfigurationCache(_Path("build/.clang_build_config"), "key")
+            files = cache.get_sources_and_headers(
+                "main", "linux", {}, directory, directory / "build"
+            )
+            cache.save()
+            return files["sourcefiles"]
+
+        self.assertEqual(sources(), [directory / "src" / "main.cpp"])
+        self.assertEqual(sources(), [directory / "src" / "main.cpp"])
+
+        # A new file in a new subdirectory is found
+        (directory / "src" / "nested").mkdir()
+        (directory / "src" / "nested" / "other.cpp").write_text("int other();\n")
+        self.assertEqual(len(sources()), 2)
+
+    def test_probe_cache(self):
+        compiler = _Path("build/compiler")
+        compiler.parent.mkdir()
+        compiler.write_text("#!/bin/sh\n")
+        probes = []
+
+        def probe():
+            probes.append(1)
+            return "-std=c++17"
+
+        for _ in range(2):
+            self.assertEqual(
+                ProbeCache(_Path("build/toolchains.json")).probe(
+                    compiler, "dialect", probe
+                ),
+                "-std=c++17",
+            )
+        self.assertEqual(len(probes), 1)
+
+        # A changed compiler is probed again
+        compiler.write_text("#!/bin/sh\nexit 0\n")
+        ProbeCache(_Path("build/toolchains.json")).probe(compiler, "dialect", probe)
+        self.assertEqual(len(probes), 2)
+
+        # Builds keep the probes in the build directory, so that a build with
+        # nothing to do does not start any process
+        clang_build_try_except(["-d", "test/mwe"])
+        self.assertTrue(_Path("build/.clang_build_toolchains").exists())
+        with unittest.mock.patch("subprocess.Popen", side_effect=AssertionError):
+            clang_build_try_except(["-d", "test/mwe"])
+
+    def test_content_hash(self):
+        clang_build_try_except(
+            ["-d", "test/mwe_with_default_folders", "--content-hash"]
+        )
+
+        object_file = _Path("build/default/obj/main.o").resolve()
+        header = _Path("test/mwe_with_default_folders/include/smallfunctions.hpp")
+        header_stat = header.stat()
+        try:
+            newer = object_file.stat().st_mtime + 10
+            os.utime(header, (header_stat.st_atime, newer))
+            build_state = BuildState(_Path("build") / ".clang_build_deps", True)
+            self.assertFalse(build_state.needs_rebuild(object_file))
+            build_state = BuildState(_Path("build") / ".clang_build_deps")
+            self.assertTrue(build_state.needs_rebuild(object_file))
+        finally:
+            os.utime(header, (header_stat.st_atime, header_stat.st_mtime))
+
+    def test_compile_cache(self):
+        cache_args = ["--cache", "--cache-dir", "build/cache"]
+        clang_build_try_except(["-d", "test/mwe"] + cache_args)
+        shutil.rmtree("build/default", onerror=on_rm_error)
+        clang_build_try_except(["-d", "test/mwe"] + cache_args)
+
+        try:
+            output = (
+                subprocess.check_output(
+                    ["./build/default/bin/main"], stderr=subprocess.STDOUT
+                )
+                .decode("utf-8")
+                .strip()
+            )
+        except subprocess.CalledProcessError as e:
+            self.fail(f"Could not run compiled program. Message:\n{e.output}")
+        self.assertEqual(output, "Hello!")
+
+        stats = CompileCache("build/cache").stats()
+        self.assertEqual(stats["objects"], 1)
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        # System headers are part of the cache key, and so of the restored
+        # dependency file
+        self.assertIn("iostream", _Path("build/default/dep/hello.d").read_text())
+
+    def test_relocatable_cache(self):
+        for checkout in ["build/checkout1", "build/checkout2"]:
+            shutil.copytree("test/mwe", checkout)
+            shutil.rmtree("build/default", ignore_errors=True)
+            clang_build_try_except(
+                [
+                    "-d",
+                    checkout,
+                    "--relocatable",
+                    "--cache",
+                    "--cache-dir",
+                    "build/cache",
+                ]
+            )
+
+        stats = CompileCache("build/cache").stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertIn("checkout2", _Path("build/default/dep/hello.d").read_text())
+
+    def test_cache_archive(self):
+        clang_build_try_except(
+            ["-d", "test/mwe", "--cache", "--cache-dir", "build/cache"]
+        )
+        cli.cache(
+            cli.parse_cache_args(
+                ["export", "build/cache.tar.gz", "--build-dir", "build"]
+                + ["--cache-dir", "build/cache"]
+            )
+        )
+        cli.cache(
+            cli.parse_cache_args(
+                ["import", "build/cache.tar.gz", "--cache-dir", "build/imported"]
+            )
+        )
+
+        shutil.rmtree("build/default", onerror=on_rm_error)
+        clang_build_try_except(
+            ["-d", "test/mwe", "--cache", "--cache-dir", "build/imported"]
+        )
+        stats = CompileCache("build/imported").stats()
+        self.assertEqual(stats["objects"], 1)
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 0))
+
+    def test_explain_cache(self):
+        cache_args = ["--cache-dir", "build/cache"]
+        clang_build_try_except(["-d", "test/mwe", "--cache"] + cache_args)
+
+        def explain(build_type):
+            args = cli.parse_args(
+                ["-d", "test/mwe", "-b", build_type]
+                + ["--explain-cache", "test/mwe/hello.cpp"]
+                + cache_args
+            )
+            environment = Environment(vars(args))
+            Project.from_directory(_Path(args.directory), environment).configure()
+            return list(environment.cache_explanations.values())
+
+        self.assertEqual(explain("default"), [[]])
+        self.assertIn(
+            f"flag {_Path('build/release/obj/hello.o').resolve()} added",
+            explain("release")[0],
+        )
+
+    def test_remote_cache(self):
+        with CacheServer("build/remote") as server:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                for local_cache in ["build/cache1", "build/cache2"]:
+                    shutil.rmtree("build/default", ignore_errors=True)
+                    clang_build_try_except(
+                        ["-d", "test/mwe", "--cache-dir", local_cache]
+                        + ["--remote-cache", server.url]
+                    )
+            finally:
+                server.shutdown()
+                thread.join()
+
+        try:
+            output = (
+                subprocess.check_output(
+                    ["./build/default/bin/main"], stderr=subprocess.STDOUT
+                )
+                .decode("utf-8")
+                .strip()
+            )
+        except subprocess.CalledProcessError as e:
+            self.fail(f"Could not run compiled program. Message:\n{e.output}")
+        self.assertEqual(output, "Hello!")
+
+        stats = CompileCache("build/cache2").stats()
+        self.assertEqual((stats["hits"], stats["remote_hits"]), (1, 1))
+
+    def test_depfile_parser(self):
+        text = (
+            "obj/main.o: src/main.cpp include/with\\ space.h \\\n"
+            "  C:\\include\\windows.h include/a.h \\\n"
+            "  include/a.h\n"
+            "include/a.h:\n"
+        )
+        self.assertEqual(
+            parse_depfile_text(text),
+            [
+                "src/main.cpp",
+                "include/with space.h",
+                "C:\\include\\windows.h",
+                "include/a.h",
+            ],
+        )
+
+    def test_shared_library_interface(self):
+        output = "_Z1av T 1130 b\ncounter D 4010 4\n_Z1bv T 1140 d\n"
+        moved = "_Z1bv T 1150 d\n_Z1av T 1160 f\ncounter D 4020 4\n"
+        self.assertEqual(
+            toolchain.LLVM._parse_interface(output),
+            ["_Z1av T", "_Z1bv T", "counter D 4"],
+        )
+        self.assertEqual(
+            toolchain.LLVM._parse_interface(output),
+            toolchain.LLVM._parse_interface(moved),
+        )
+
+    def test_build_async(self):
+        async def build_in_running_loop():
+            args = cli.parse_args(["-d", "test/mwe"])
+            project = Project.from_directory(
+                _Path(args.directory), Environment(vars(args))
+            )
+            await project.build_async()
+
+        asyncio.run(build_in_running_loop())
+
+        try:
+            output = (
+                subprocess.check_output(
+                    ["./build/default/bin/main"], stderr=subprocess.STDOUT
+                )
+                .decode("utf-8")
+                .strip()
+            )
+        except subprocess.CalledProcessError as e:
+            self.fail(f"Could not run compiled program. Message:\n{e.output}")
+
+        self.assertEqual(output, "Hello!")
+
+    def test_legacy_toolchain_compile(self):
+        directory = _Path("build/legacy").resolve()
+        (directory / "include").mkdir(parents=True)
+        (directory / "include" / "header.hpp").write_text("int f();\n")
+        (directory / "main.cpp").write_text('#include "header.hpp"\n')
+        compiled = []
+
+        class LegacyToolchain(toolchain.Toolchain):
+            def __init__(self):
+                super().__init__()
+                self.cpp_compiler = shutil.which("clang++")
+
+            def compile(
+                self, source_file, object_file, include_directories, flags, is_c_target
+            ):
+                compiled.append(source_file)
+                return ["compile"], True, ""
+
+            def link(self, *args):
+                return ["link"], True, ""
+
+            def archive(self, *args):
+                return ["archive"], True, ""
+
+        # The dependency file is generated before compiling with the old signature
+        command, success, _ = asyncio.run(
+            LegacyToolchain().compile_async(
+                directory / "main.cpp",
+                directory / "main.o",
+                [directory / "include"],
+                [],
+                False,
+                dependency_file=directory / "dep" / "main.d",
+            )
+        )
+        self.assertTrue(success)
+        self.assertEqual(command, ["compile"])
+        self.assertEqual(compiled, [directory / "main.cpp"])
+        self.assertIn("header.hpp", (directory / "dep" / "main.d").read_text())
+
     def test_automatic_include_folders(self):
         clang_build_try_except(["-d", "test/mwe_with_default_folders", "-V"])
 
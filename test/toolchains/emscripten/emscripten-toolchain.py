@@ -204,24 +204,24 @@ class Emscripten(clang_build.toolchain.Toolchain):
         except _subprocess.CalledProcessError as error:
             return False, error.output.strip()
 
-    def generate_dependency_file(
-        self, source_file, dependency_file, flags, include_directories, is_c_target
-    ):
-        dependency_file.parents[0].mkdir(parents=True, exist_ok=True)
-
-        command = self._get_compiler_command(
-            source_file, None, include_directories, flags, is_c_target
-        ) + ["-E", "-MMD", str(source_file), "-MF", str(dependency_file)]
-        return command, *self._run_clang_command(command)
-
     def compile(
-        self, source_file, object_file, include_directories, flags, is_c_target
+        self,
+        source_file,
+        object_file,
+        include_directories,
+        flags,
+        is_c_target,
+        dependency_file=None,
     ):
         object_file.parents[0].mkdir(parents=True, exist_ok=True)
 
         command = self._get_compiler_command(
             source_file, object_file, include_directories, flags, is_c_target
         )
+        if dependency_file:
+            dependency_file.parents[0].mkdir(parents=True, exist_ok=True)
+            command += ["-MMD", "-MF", str(dependency_file)]
+
         return command, *self._run_clang_command(command)
 
     def link(